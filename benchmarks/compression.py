@@ -0,0 +1,91 @@
+"""Compare the compression presets: write time, archive size and reload time of each Explorer file.
+
+Usage:
+    python benchmarks/compression.py [--n-transcripts 2000000] [--n-cells 200000] [--n-genes 500]
+"""
+
+import argparse
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+import dask.dataframe as dd
+import numpy as np
+import pandas as pd
+import zarr
+from anndata import AnnData
+from scipy.sparse import random as sparse_random
+
+from spatialdata_xenium_explorer import write_gene_counts, write_transcripts
+from spatialdata_xenium_explorer._compression import COMPRESSION_PRESETS
+
+
+def transcripts(n_transcripts: int, n_genes: int) -> dd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "x": rng.uniform(0, 40_000, n_transcripts),
+            "y": rng.uniform(0, 40_000, n_transcripts),
+            "gene": rng.integers(0, n_genes, n_transcripts).astype(str),
+        }
+    )
+    return dd.from_pandas(df, npartitions=8)
+
+
+def table(n_cells: int, n_genes: int) -> AnnData:
+    X = sparse_random(n_cells, n_genes, density=0.05, format="csr", random_state=0)
+    X.data = np.ceil(X.data * 20)
+    return AnnData(X.astype(np.float32))
+
+
+def reload(path: Path) -> None:
+    """Read and decompress every array of the archive"""
+    with zipfile.ZipFile(path) as zf:
+        store = {name: zf.read(name) for name in zf.namelist()}
+
+    for key in store:
+        if key.endswith(".zarray"):
+            zarr.open_array(store, mode="r", path=key[: -len(".zarray")])[...]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-transcripts", type=int, default=2_000_000)
+    parser.add_argument("--n-cells", type=int, default=200_000)
+    parser.add_argument("--n-genes", type=int, default=500)
+    args = parser.parse_args()
+
+    df = transcripts(args.n_transcripts, args.n_genes)
+    adata = table(args.n_cells, args.n_genes)
+
+    workloads = {
+        "transcripts.zarr.zip": lambda path, compression: write_transcripts(
+            path, df, "gene", is_dir=False, compression=compression
+        ),
+        "cell_feature_matrix.zarr.zip": lambda path, compression: write_gene_counts(
+            path, adata, is_dir=False, compression=compression
+        ),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for filename, workload in workloads.items():
+            path = Path(tmp_dir) / filename
+            print(f"\n{filename}")
+            print(f"  {'preset':<10} {'write (s)':>10} {'size (MB)':>10} {'reload (s)':>11}")
+
+            for preset in COMPRESSION_PRESETS:
+                start = time.perf_counter()
+                workload(path, preset)
+                write_duration = time.perf_counter() - start
+
+                start = time.perf_counter()
+                reload(path)
+                reload_duration = time.perf_counter() - start
+
+                size = path.stat().st_size / 1024**2
+                print(f"  {preset:<10} {write_duration:10.2f} {size:10.1f} {reload_duration:11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compare the previous direct `zarr.ZipStore` writing with the staged `explorer_store`.
+
+Usage:
+    python benchmarks/stores.py [--n-tiles 20000] [--n-cells 2000000]
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import zarr
+
+from spatialdata_xenium_explorer._store import explorer_store
+
+
+def write_tiles(store, n_tiles: int):
+    """Many tiny arrays, as in `transcripts.zarr.zip`"""
+    rng = np.random.default_rng(0)
+    g = zarr.group(store=store)
+
+    for i, n in enumerate(rng.integers(1, 500, n_tiles)):
+        tile_group = g.create_group(str(i))
+        for name in ["valid", "location", "gene_identity", "id"]:
+            tile_group.array(name, rng.random((n, 2)), dtype="float32", chunks=(n, 1))
+
+
+def write_large(store, n_cells: int):
+    """A few large arrays, as in `cell_feature_matrix.zarr.zip`"""
+    rng = np.random.default_rng(0)
+    g = zarr.group(store=store)
+
+    for name in ["data", "indices", "indptr"]:
+        g.array(name, rng.integers(0, 1000, n_cells * 10), dtype="uint32", chunks=(n_cells * 10,))
+
+
+STORES = {
+    "zarr.ZipStore (previous)": lambda path: zarr.ZipStore(path, mode="w"),
+    "explorer_store (memory)": explorer_store,
+    "explorer_store (spilled)": lambda path: explorer_store(path, memory_limit_gb=0),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-tiles", type=int, default=20_000)
+    parser.add_argument("--n-cells", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    workloads = {
+        f"{args.n_tiles} tiles": lambda store: write_tiles(store, args.n_tiles),
+        f"{args.n_cells} cells": lambda store: write_large(store, args.n_cells),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "bench.zarr.zip"
+
+        for workload_name, workload in workloads.items():
+            print(f"\n{workload_name}")
+
+            for store_name, store_factory in STORES.items():
+                start = time.perf_counter()
+                with store_factory(path) as store:
+                    workload(store)
+                duration = time.perf_counter() - start
+
+                size = path.stat().st_size / 1024**2
+                print(f"  {store_name:<28} {duration:8.2f} s {size:10.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable
+
+import dask
+import dask.array as da
+import dask.dataframe as dd
+from dask.base import tokenize
+from multiscale_spatial_image import MultiscaleSpatialImage
+from spatial_image import SpatialImage
+from spatialdata import SpatialData
+from spatialdata.transformations import get_transformation
+
+from . import __version__
+from ._constants import FileNames
+
+log = logging.getLogger(__name__)
+
+
+class BuildCache:
+    """Manifest of the fingerprints of the Explorer files, used to skip the files whose inputs didn't change
+
+    Args:
+        path: Path to the Xenium Explorer directory (the manifest is saved inside it)
+        force: If `True`, all the files are considered outdated (they are written again)
+    """
+
+    def __init__(self, path: Path, force: bool = False):
+        self.path = path / FileNames.MANIFEST
+        self.force = force
+        self.lock = threading.Lock()
+        self.manifest = self._read()
+        self.fingerprints: dict[str, str | None] = {}
+
+    def _read(self) -> dict:
+        if not self.path.exists():
+            return {}
+
+        try:
+            with open(self.path, "r") as f:
+                manifest = json.load(f)
+            return manifest.get("files", {})
+        except (json.JSONDecodeError, AttributeError):
+            log.warn(f"Invalid manifest file {self.path}, all the files will be written again")
+            return {}
+
+    def _save(self) -> None:
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": __version__, "files": self.manifest}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def should_write(self, file_name: str, *inputs) -> bool:
+        """Whether a file has to be written, i.e. if it doesn't exist or if the fingerprint of its inputs changed
+
+        Args:
+            file_name: Name of the Explorer file
+            *inputs: Everything the file depends on (elements, parameters). The package version is also used.
+        """
+        self.fingerprints[file_name] = fingerprint(*inputs)
+
+        entry = self._entry(file_name, self.fingerprints[file_name])
+
+        if self.force or entry is None or self.manifest.get(file_name) != entry:
+            return True
+
+        log.info(f"Skipping {file_name} (its inputs didn't change since the last run)")
+        return False
+
+    def wrap(self, file_name: str, run: Callable[[], None]) -> Callable[[], None]:
+        """Wraps the writer of a file, so that its fingerprint is saved in the manifest once written
+
+        The previous fingerprint is first removed, so that a partially written file (e.g., after a crash) is never considered up to date.
+        """
+
+        def wrapped():
+            self._set(file_name, None)
+            run()
+            self._set(file_name, self.fingerprints[file_name])
+
+        return wrapped
+
+    def _set(self, file_name: str, fingerprint: str | None) -> None:
+        with self.lock:
+            if fingerprint is None:
+                self.manifest.pop(file_name, None)
+            else:
+                self.manifest[file_name] = self._entry(file_name, fingerprint)
+            self._save()
+
+    def _entry(self, file_name: str, fingerprint: str | None) -> dict | None:
+        # the modification time detects files written outside of `write` (e.g., by `update-obs`)
+        file_path = self.path.parent / file_name
+        if fingerprint is None or not file_path.exists():
+            return None
+        return {"fingerprint": fingerprint, "mtime_ns": file_path.stat().st_mtime_ns}
+
+
+def fingerprint(*inputs) -> str | None:
+    """Deterministic fingerprint of the inputs of a file (and of the package version), or `None` if some input can't be fingerprinted"""
+    try:
+        with dask.config.set({"tokenize.ensure-deterministic": True}):
+            return tokenize(__version__, *inputs)
+    except RuntimeError:
+        return None
+
+
+def element_token(sdata: SpatialData, attr: str, key: str) -> tuple:
+    """Inputs identifying a `SpatialElement` (to be fingerprinted): its content (or its dask graph if lazy), and its transformations
+
+    For lazy elements, the dask graph name only depends on the path of the element, so the size and modification time of its files (if saved on disk) are also used. For images read from zarr without further operations, the graph names of the lower scales change at each read, so the layout of the scales is used instead of their graphs.
+    """
+    element = sdata[key]
+
+    data = element
+    if isinstance(element, MultiscaleSpatialImage):
+        xarrs = [next(iter(element[name].values())) for name in element.children]
+        data = [xarr.data for xarr in xarrs]
+    elif isinstance(element, SpatialImage):
+        xarrs = [element]
+        data = element.data
+
+    files = None
+    if _is_lazy(data) and sdata.path is not None:
+        files = _files_stats(Path(sdata.path) / attr / key)
+
+        if files is not None and _is_zarr_read(data):
+            names = list(element.children) if isinstance(element, MultiscaleSpatialImage) else None
+            data = names, [_layout_token(xarr) for xarr in xarrs]
+
+    return data, files, transformation_token(sdata, key)
+
+
+def transformation_token(sdata: SpatialData, key: str) -> str:
+    """Identity of the transformations of a `SpatialElement` (without its content)"""
+    return repr(get_transformation(sdata[key], get_all=True))
+
+
+def _is_lazy(data) -> bool:
+    if isinstance(data, list):
+        return any(_is_lazy(d) for d in data)
+    return isinstance(data, (da.Array, dd.DataFrame))
+
+
+def _is_zarr_read(data) -> bool:
+    """Whether the data is only made of dask arrays read from zarr (without further operations)"""
+    arrays = data if isinstance(data, list) else [data]
+    return all(
+        isinstance(array, da.Array)
+        and all(name.startswith(("from-zarr", "original-from-zarr")) for name in array.dask.layers)
+        for array in arrays
+    )
+
+
+def _layout_token(xarr: SpatialImage) -> tuple:
+    channels = xarr.coords["c"].values.tolist() if "c" in xarr.coords else None
+    return xarr.dims, xarr.shape, str(xarr.dtype), xarr.data.chunks, channels
+
+
+def _files_stats(directory: Path) -> list[tuple[str, int, int]] | None:
+    if not directory.exists():
+        return None
+
+    stats = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            stat = os.stat(os.path.join(root, file))
+            stats.append(
+                (
+                    os.path.relpath(os.path.join(root, file), directory),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                )
+            )
+    return sorted(stats)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import numpy as np
+from numcodecs import Blosc
+from numcodecs.abc import Codec
+
+DEFAULT = "default"  # zarr default compressor
+WILDCARD = "*"
+
+
+class CompressionPolicy:
+    """Choose the compressor of each array written in an Explorer `.zarr.zip` file
+
+    Args:
+        compressors: Dictionary whose keys are array names (e.g., `"indices"`), and values are compressors: a `numcodecs` codec, `None` (no compression), or `"default"` (zarr default compressor). The `"*"` key is used for the arrays that are not listed.
+        small_compressor: Compressor used for the arrays whose size is below `small_nbytes` (only if the array name is not in `compressors`).
+        small_nbytes: Size (in bytes) below which an array is considered small. If `0`, `small_compressor` is never used.
+    """
+
+    def __init__(
+        self,
+        compressors: dict[str, Codec | str | None] | None = None,
+        small_compressor: Codec | str | None = DEFAULT,
+        small_nbytes: int = 0,
+    ):
+        self.compressors = {WILDCARD: DEFAULT} if compressors is None else compressors
+        self.small_compressor = small_compressor
+        self.small_nbytes = small_nbytes
+
+    def __call__(self, name: str, data: np.ndarray, dtype: np.dtype) -> Codec | str | None:
+        """Compressor of the array `name`, to be provided to zarr as `compressor=`
+
+        Args:
+            name: Name of the array (e.g., `"indices"`)
+            data: Values of the array
+            dtype: Dtype used to write the array
+
+        Returns:
+            The compressor of this array
+        """
+        if name in self.compressors:
+            return self.compressors[name]
+
+        if np.size(data) * np.dtype(dtype).itemsize < self.small_nbytes:
+            return self.small_compressor
+
+        return self.compressors.get(WILDCARD, DEFAULT)
+
+
+COMPRESSION_PRESETS = {
+    "default": lambda: CompressionPolicy(),
+    "none": lambda: CompressionPolicy({WILDCARD: None}),
+    "balanced": lambda: CompressionPolicy(
+        {WILDCARD: Blosc(cname="zstd", clevel=3, shuffle=Blosc.SHUFFLE)},
+        small_compressor=None,
+        small_nbytes=64 * 1024,
+    ),
+    "compact": lambda: CompressionPolicy(
+        {WILDCARD: Blosc(cname="zstd", clevel=7, shuffle=Blosc.BITSHUFFLE)}
+    ),
+}
+
+
+def get_compression_policy(
+    compression: str | dict | CompressionPolicy | None, filename: str | None = None
+) -> CompressionPolicy:
+    """Get the compression policy of one Explorer file
+
+    Args:
+        compression: One of the presets (`"default"`, `"none"`, `"balanced"`, `"compact"`), a `CompressionPolicy`, or a dictionary of compressors per array name (see `CompressionPolicy`). If `filename` is provided, it can also be a dictionary whose keys are Explorer file names (e.g., `"transcripts.zarr.zip"`) and values are one of the above.
+        filename: Name of the Explorer file being written.
+
+    Returns:
+        A `CompressionPolicy`
+    """
+    if compression is None:
+        return COMPRESSION_PRESETS[DEFAULT]()
+
+    if isinstance(compression, CompressionPolicy):
+        return compression
+
+    if isinstance(compression, str):
+        assert (
+            compression in COMPRESSION_PRESETS
+        ), f"Compression preset must be one of {', '.join(COMPRESSION_PRESETS)}. Found '{compression}'"
+        return COMPRESSION_PRESETS[compression]()
+
+    if filename is not None and any(key.endswith(".zip") for key in compression):
+        return get_compression_policy(compression.get(filename))
+
+    return CompressionPolicy(compression)
@@ -5,6 +5,7 @@ class FileNames:
     TABLE = "cell_feature_matrix.zarr.zip"
     CELL_CATEGORIES = "analysis.zarr.zip"
     METADATA = "experiment.xenium"
+    MANIFEST = ".explorer_manifest.json"
 
 
 class ExplorerConstants:
@@ -24,9 +25,18 @@ class Versions:
     CELL_CATEGORIES = [1, 0]
 
 
+class PointsConstants:
+    Z = "z"
+    QUALITY_SCORE = "qv"
+    TRANSCRIPT_ID = "transcript_id"
+
+
 class ShapesConstants:
     RADIUS = "radius"
     DEFAULT_POINT_RADIUS = 100
+    POINT_TYPE_ID = 0  # see shapely.get_type_id
+    POLYGON_TYPE_ID = 3
+    MULTIPOLYGON_TYPE_ID = 6
 
 
 def cell_categories_attrs() -> dict:
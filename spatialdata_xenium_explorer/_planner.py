@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import logging
+from typing import Callable
+
+import dask.dataframe as dd
+import numpy as np
+from anndata import AnnData
+from multiscale_spatial_image import MultiscaleSpatialImage
+from scipy.sparse import issparse
+from spatial_image import SpatialImage
+
+from ._store import DEFAULT_STAGING_MEMORY_GB
+from .core.images import MultiscaleImageWriter
+
+log = logging.getLogger(__name__)
+
+GB = 1024**3
+
+# peak memory of the in-memory strategies (measured with tracemalloc, then rounded up)
+COUNTS_BYTES_PER_VALUE = 32  # transposed copy of the matrix, concatenated data/indices
+POLYGONS_BYTES_PER_VERTEX = 64  # simplified geometries, padded float64 and float32 coordinates
+TRANSCRIPTS_BYTES_PER_POINT = 128  # pandas dataframe, shuffled copy and tile arrays
+IMAGE_MEMORY_FACTOR = 2  # level in the image dtype, and its scaled (and resized) copy
+IMAGE_STRIPS = 2  # strip of tiles being written, and the next one read in the background
+
+# part of the budget reserved to the staging buffers of the `.zarr.zip` files (see `explorer_store`)
+STAGING_BUDGET_FRACTION = 0.25
+N_STAGED_FILES = 4  # counts, categories, boundaries and transcripts (may be written concurrently)
+
+
+class MemoryPlan:
+    """Choose the strategy of each stage of `write`, so that its estimated peak memory stays below a budget
+
+    The staging buffers of the `.zarr.zip` files are also limited, and their memory is included in the estimate of each stage (all the buffers can be alive at the same time if the files are written concurrently).
+
+    Args:
+        budget_gb: Memory budget (in gigabytes). If `None`, the default strategies are kept.
+        parallel: Whether the files are written concurrently.
+    """
+
+    def __init__(self, budget_gb: float | None = None, parallel: bool = False):
+        self.budget_gb = budget_gb
+        self.stages: list[tuple[str, float, str]] = []
+
+        self.staging_gb = DEFAULT_STAGING_MEMORY_GB
+        self.n_buffers = N_STAGED_FILES if parallel else 1
+
+        if budget_gb is not None:
+            self.staging_gb = min(
+                DEFAULT_STAGING_MEMORY_GB, budget_gb * STAGING_BUDGET_FRACTION / self.n_buffers
+            )
+            log.info(
+                f"Planning the conversion with a memory budget of {budget_gb:.2f} GB (staging buffers of {self.staging_gb:.2f} GB)"
+            )
+
+    def _staging_nbytes(self) -> float:
+        return self.n_buffers * self.staging_gb * GB
+
+    def _fits(self, nbytes: float) -> bool:
+        return nbytes <= self.budget_gb * GB
+
+    def _log(self, stage: str, nbytes: float, strategy: str) -> None:
+        self.stages.append((stage, nbytes, strategy))
+        log.info(f"   > {stage}: {nbytes / GB:.2f} GB estimated in memory -> {strategy}")
+
+    def streaming(
+        self, stage: str, estimate: Callable[..., float], *args, default: bool | None = False
+    ) -> bool | None:
+        """Whether a stage has to be streamed, i.e. if its in-memory strategy is above the budget
+
+        Args:
+            stage: Name of the stage (used for logging)
+            estimate: Function returning the peak memory (in bytes) of the in-memory strategy, called on `args` (only if there is a budget)
+            default: Value returned when the in-memory strategy fits the budget, or if there is no budget
+
+        Returns:
+            `True` if the stage has to be streamed, else `default`
+        """
+        if self.budget_gb is None:
+            return default
+
+        nbytes = estimate(*args) + self._staging_nbytes()
+
+        if self._fits(nbytes):
+            self._log(stage, nbytes, "in-memory" if default is False else "default")
+            return default
+
+        self._log(stage, nbytes, "streaming")
+        return True
+
+    def image_kwargs(
+        self, image: SpatialImage | MultiscaleSpatialImage, lazy: bool, ram_threshold_gb: int | None
+    ) -> dict:
+        """Arguments of `write_image` (procedure of the image writer) that fit the budget
+
+        The levels that are not loaded in memory are read by strips of tiles, whose size is also limited by the budget.
+        """
+        kwargs = {"lazy": lazy, "ram_threshold_gb": ram_threshold_gb}
+
+        if self.budget_gb is None:
+            return kwargs
+
+        available_gb = self.budget_gb - self._staging_nbytes() / GB
+        kwargs["max_strip_gb"] = max(
+            0, min(MultiscaleImageWriter.max_strip_bytes / GB, available_gb / IMAGE_STRIPS)
+        )
+        log.info(f"   > image: strips of tiles of at most {kwargs['max_strip_gb']:.2f} GB")
+
+        nbytes = image_nbytes(image) + self._staging_nbytes()
+
+        if not self._fits(nbytes):
+            self._log("image", nbytes, "streaming")
+            return kwargs | {"streaming": True}
+
+        if lazy and ram_threshold_gb is not None:
+            # a level is loaded in memory only if it fits the budget
+            kwargs["ram_threshold_gb"] = min(ram_threshold_gb, available_gb / IMAGE_MEMORY_FACTOR)
+
+        strategy = "in-memory" if not lazy else "lazy" if ram_threshold_gb is None else "semi-lazy"
+        self._log("image", nbytes, strategy)
+        return kwargs
+
+    def summary(self) -> None:
+        if self.budget_gb is None or not self.stages:
+            return
+
+        stage, nbytes, _ = max(self.stages, key=lambda stage: stage[1])
+        log.info(
+            f"Memory plan: {', '.join(f'{s}={strategy}' for s, _, strategy in self.stages)} (largest in-memory estimate: {stage}, {nbytes / GB:.2f} GB)"
+        )
+
+
+def counts_nbytes(adata: AnnData, layer: str | None = None) -> float:
+    """Estimated peak memory of the in-memory cell-by-gene writer"""
+    counts = adata.X if layer is None else adata.layers[layer]
+
+    if issparse(counts):
+        return counts.nnz * COUNTS_BYTES_PER_VALUE
+    return np.prod(counts.shape) * COUNTS_BYTES_PER_VALUE  # dense, or unknown number of values
+
+
+def polygons_nbytes(n_cells: int, max_vertices: int, n_polygon_sets: int = 2) -> float:
+    """Estimated peak memory of the in-memory polygons writer (cells and nuclei)"""
+    return n_cells * max_vertices * n_polygon_sets * POLYGONS_BYTES_PER_VERTEX
+
+
+def transcripts_nbytes(df: dd.DataFrame) -> float:
+    """Estimated peak memory of the in-memory transcripts writer (the number of transcripts is extrapolated from the first partition)"""
+    n_points = len(df.get_partition(0)) * df.npartitions
+    return n_points * TRANSCRIPTS_BYTES_PER_POINT
+
+
+def image_nbytes(image: SpatialImage | MultiscaleSpatialImage) -> float:
+    """Estimated peak memory when the full-resolution image is loaded in memory"""
+    if isinstance(image, MultiscaleSpatialImage):
+        image = next(iter(image["scale0"].values()))
+
+    return np.prod(image.shape) * image.dtype.itemsize * IMAGE_MEMORY_FACTOR
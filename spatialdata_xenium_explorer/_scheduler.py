@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import gc
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from time import perf_counter
+from typing import Callable
+
+log = logging.getLogger(__name__)
+
+
+class Stage:
+    """One independent output of `write`, and its resource hints
+
+    Args:
+        name: Name of the stage (used for logging)
+        run: Function writing the output (called without arguments)
+        memory: Whether the stage is memory-heavy. Two memory-heavy stages never run at the same time.
+        processes: Whether the stage starts a process pool. Such stages run before the others, since forking a process while other threads are running can deadlock.
+    """
+
+    def __init__(
+        self, name: str, run: Callable[[], None], memory: bool = False, processes: bool = False
+    ):
+        self.name = name
+        self.run = run
+        self.memory = memory
+        self.processes = processes
+
+
+def run_stages(stages: list[Stage], parallel: bool = False) -> None:
+    """Run the stages, either one after the other, or concurrently on a thread pool
+
+    Args:
+        stages: Stages to run. The list is emptied, so that the inputs of a stage are released once it is done.
+        parallel: Whether to run the stages concurrently (according to their resource hints).
+    """
+    stages.sort(key=lambda stage: not stage.processes)  # stable: keeps the order otherwise
+
+    if not parallel or len(stages) <= 1:
+        while stages:
+            _run_stage(stages.pop(0))
+        return
+
+    while stages and stages[0].processes:
+        _run_stage(stages.pop(0))
+
+    memory_lock = threading.Lock()
+
+    log.info(f"Running {len(stages)} stages concurrently ({', '.join(s.name for s in stages)})")
+    with ThreadPoolExecutor(len(stages)) as executor:
+        futures = []
+        while stages:
+            futures.append(executor.submit(_run_stage, stages.pop(0), memory_lock))
+
+        for future in futures:
+            future.result()
+
+
+def _run_stage(stage: Stage, memory_lock: threading.Lock | None = None) -> None:
+    with memory_lock if memory_lock is not None and stage.memory else nullcontext():
+        start = perf_counter()
+        stage.run()
+        log.info(f"   > Stage '{stage.name}' done in {perf_counter() - start:.2f}s")
+
+    del stage
+    gc.collect()
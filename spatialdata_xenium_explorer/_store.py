@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+import uuid
+import zipfile
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+log = logging.getLogger(__name__)
+
+# fixed timestamp, so that identical contents give identical files
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+DEFAULT_STAGING_MEMORY_GB = 1
+
+
+class StagingStore(MutableMapping):
+    """Zarr store where an Explorer file is staged before being packed into a `.zarr.zip` file
+
+    The values are kept in memory until `memory_limit` bytes are reached. The next values are appended to a temporary spill file (one file for all keys), so writing many small arrays stays fast and the memory usage stays bounded.
+    """
+
+    def __init__(self, spill_dir: Path, memory_limit: int):
+        self.spill_dir = spill_dir
+        self.memory_limit = memory_limit
+
+        self.values: dict[str, bytes | tuple[int, int]] = {}
+        self.memory_size = 0
+        self.spill_file = None
+
+    def _spill(self, value: bytes) -> tuple[int, int]:
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(dir=self.spill_dir, prefix=".staging_")
+
+        offset = self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(value)
+        return offset, len(value)
+
+    def __setitem__(self, key: str, value) -> None:
+        value = bytes(value)
+
+        if key in self:
+            del self[key]
+
+        if self.memory_size + len(value) <= self.memory_limit:
+            self.values[key] = value
+            self.memory_size += len(value)
+        else:
+            self.values[key] = self._spill(value)
+
+    def __getitem__(self, key: str) -> bytes:
+        value = self.values[key]
+
+        if isinstance(value, bytes):
+            return value
+
+        offset, size = value
+        self.spill_file.seek(offset)
+        return self.spill_file.read(size)
+
+    def __delitem__(self, key: str) -> None:
+        value = self.values.pop(key)
+        if isinstance(value, bytes):
+            self.memory_size -= len(value)
+
+    def __contains__(self, key) -> bool:
+        return key in self.values
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def pack(self, path: Path) -> None:
+        """Write all the keys into a `.zarr.zip` file (uncompressed), in one sequential pass.
+
+        The zip is first written next to `path` and then renamed, so `path` is never left half-written.
+        """
+        # unlike mkstemp (mode 0600), open keeps the default permissions of the user (umask)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_file = open(tmp_path, "xb")
+
+        try:
+            with tmp_file, zipfile.ZipFile(
+                tmp_file, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True
+            ) as zf:
+                for key in self.values:
+                    info = zipfile.ZipInfo(key, date_time=ZIP_DATE_TIME)
+                    info.compress_type = zipfile.ZIP_STORED
+                    info.external_attr = 0o644 << 16
+                    zf.writestr(info, self[key])
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def close(self) -> None:
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.values = {}
+        self.memory_size = 0
+
+
+@contextmanager
+def explorer_store(
+    path: Path, memory_limit_gb: float = DEFAULT_STAGING_MEMORY_GB
+) -> Iterator[StagingStore]:
+    """Context manager providing the store of an Explorer `.zarr.zip` file
+
+    The arrays are staged (in memory, then in a temporary spill file if above `memory_limit_gb`), and packed into `path` when leaving the context. If an error occurs, `path` is not modified.
+
+    Args:
+        path: Path to the `.zarr.zip` file to be written
+        memory_limit_gb: Size (in gigabytes) of the staged values kept in memory before spilling to disk
+
+    Yields:
+        A `MutableMapping` that can be used as a zarr store
+    """
+    path = Path(path)
+    store = StagingStore(path.parent, int(memory_limit_gb * 1024**3))
+
+    try:
+        yield store
+        store.pack(path)
+    finally:
+        store.close()
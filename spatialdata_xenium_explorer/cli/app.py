@@ -20,6 +20,10 @@ def write(
         None,
         help="Name of the cell shapes (key of `sdata.shapes`). This argument doesn't need to be provided if there is only one shapes key or a table with only one region.",
     ),
+    nucleus_key: str = typer.Option(
+        None,
+        help="Name of the nucleus shapes (key of `sdata.shapes`). If not provided, the cell boundaries are also used as nucleus boundaries.",
+    ),
     points_key: str = typer.Option(
         None,
         help="Name of the transcripts (key of `sdata.points`). This argument doesn't need to be provided if there is only one points key.",
@@ -48,6 +52,34 @@ def write(
         None,
         help="string that indicated which files should be created. `'-ib'` means everything except images and boundaries, while `'+tocm'` means only transcripts/observations/counts/metadata (each letter corresponds to one explorer file). By default, keeps everything",
     ),
+    compression: str = typer.Option(
+        "default",
+        help="Compressor of the arrays inside the `.zarr.zip` files: one of `'default'`, `'none'`, `'balanced'`, `'compact'`",
+    ),
+    n_workers: int = typer.Option(
+        1,
+        help="Number of workers used to simplify the cell polygons and to encode the transcripts and image tiles",
+    ),
+    image_contrast: str = typer.Option(
+        None,
+        help="Contrast of each image channel: `'minmax'` or `'percentile'`. By default, the values are scaled according to the maximum value of the image dtype",
+    ),
+    memory_budget_gb: float = typer.Option(
+        None,
+        help="Memory budget (in gigabytes). If provided, the files that wouldn't fit in the budget are streamed, and the plan is logged",
+    ),
+    parallel: bool = typer.Option(
+        False,
+        help="Whether to write the files concurrently. The memory-heavy files are still written one at a time",
+    ),
+    force: bool = typer.Option(
+        False,
+        help="Whether to write all the files. By default, the files whose inputs didn't change since the last run are skipped",
+    ),
+    points_per_tile: int = typer.Option(
+        None,
+        help="Maximum number of transcripts per tile on the subsampled levels of the transcripts pyramid (stratified sampling). By default, the tiles are not capped",
+    ),
 ):
     """Convert a spatialdata object to Xenium Explorer's inputs"""
     from pathlib import Path
@@ -66,6 +98,7 @@ def write(
         sdata,
         image_key=image_key,
         shapes_key=shapes_key,
+        nucleus_key=nucleus_key,
         points_key=points_key,
         gene_column=gene_column,
         pixel_size=pixel_size,
@@ -74,6 +107,13 @@ def write(
         lazy=lazy,
         ram_threshold_gb=ram_threshold_gb,
         mode=mode,
+        compression=compression,
+        n_workers=n_workers,
+        image_contrast=image_contrast,
+        memory_budget_gb=memory_budget_gb,
+        parallel=parallel,
+        force=force,
+        points_per_tile=points_per_tile,
     )
 
 
@@ -89,22 +129,32 @@ def update_obs(
     """Update the cell categories for the Xenium Explorer's (i.e. what's in `adata.obs`). This is useful when you perform analysis and update your `AnnData` object
 
     Usage:
-        This command should only be used if you updated `adata.obs`, after creation of the other explorer files.
+        This command should only be used if you updated `adata.obs`, after creation of the other explorer files. Only `adata.obs` is read, and only the new or modified columns are encoded again.
     """
     from pathlib import Path
 
     import anndata
 
+    try:
+        from anndata.io import read_elem
+    except ImportError:  # anndata < 0.11
+        from anndata.experimental import read_elem
+
     from spatialdata_xenium_explorer import write_cell_categories
 
     path = Path(adata_path)
 
     if path.is_dir():
-        adata = anndata.read_zarr(path)
+        import zarr
+
+        obs = read_elem(zarr.open(path, mode="r")["obs"])
     else:
-        adata = anndata.read_h5ad(path)
+        import h5py
+
+        with h5py.File(path, "r") as f:
+            obs = read_elem(f["obs"])
 
-    write_cell_categories(output_path, adata)
+    write_cell_categories(output_path, anndata.AnnData(obs=obs))
 
 
 @app.command()
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import json
 import logging
+from functools import partial
 from pathlib import Path
 
 import geopandas as gpd
@@ -15,7 +16,12 @@ from . import (
     write_polygons,
     write_transcripts,
 )
+from ._cache import BuildCache, element_token, transformation_token
+from ._compression import get_compression_policy
 from ._constants import FileNames, experiment_dict
+from ._planner import MemoryPlan, counts_nbytes, polygons_nbytes, transcripts_nbytes
+from ._scheduler import Stage, run_stages
+from .core.shapes import match_nuclei
 
 log = logging.getLogger(__name__)
 
@@ -31,9 +37,18 @@ def write(
     spot: bool = False,
     layer: str | None = None,
     polygon_max_vertices: int = 13,
+    polygon_simplification: str = "tolerance",
     lazy: bool = True,
     ram_threshold_gb: int | None = 4,
     mode: str = None,
+    compression: str | dict = "default",
+    n_workers: int = 1,
+    nucleus_key: str | None = None,
+    image_contrast: str | list[tuple[float, float]] | None = None,
+    memory_budget_gb: float | None = None,
+    parallel: bool = False,
+    force: bool = False,
+    points_per_tile: int | None = None,
 ) -> None:
     """
     Transform a SpatialData object into inputs for the Xenium Explorer.
@@ -68,14 +83,26 @@ def write(
         spot: Whether the technology is based on spots
         layer: Layer of `sdata.table` where the gene counts are saved. If `None`, uses `sdata.table.X`.
         polygon_max_vertices: Maximum number of vertices for the cell polygons. A higher value will display smoother cells.
+        polygon_simplification: How the cell polygons are simplified to `polygon_max_vertices` vertices: `"tolerance"` (increasing Douglas-Peucker tolerance) or `"visvalingam"` (Visvalingam-Whyatt, giving exactly `polygon_max_vertices` vertices).
         lazy: If `True`, will not load the full images in memory (except if the image memory is below `ram_threshold_gb`).
         ram_threshold_gb: Threshold (in gygabytes) from which image can be loaded in memory. If `None`, the image is never loaded in memory.
         mode: string that indicated which files should be created. "-ib" means everything except images and boundaries, while "+tocm" means only transcripts/observations/counts/metadata (each letter corresponds to one explorer file). By default, keeps everything.
+        compression: Compressor of the arrays inside the `.zarr.zip` files: one of `"default"`, `"none"`, `"balanced"`, `"compact"`. It can also be a dictionary whose keys are file names (e.g., `"transcripts.zarr.zip"`) and values are presets or dictionaries of compressors per array name.
+        n_workers: Number of workers used to simplify the cell polygons (processes), to group the cell categories and to encode the transcripts and image tiles (threads).
+        nucleus_key: Optional name of the nucleus shapes (key of `sdata.shapes`). Each nucleus is matched to the cell that contains it. If not provided, the cell boundaries are also used as nucleus boundaries.
+        image_contrast: Contrast of each image channel: `"minmax"`, `"percentile"`, or one `(low, high)` window per channel. By default, the values are scaled according to the maximum value of the image dtype (see `write_image`).
+        memory_budget_gb: Optional memory budget (in gigabytes). If provided, the peak memory of each file is estimated, and the files that wouldn't fit in the budget are streamed (the image procedure is also chosen accordingly). The in-memory staging buffers of the `.zarr.zip` files are also limited according to the budget. The plan is logged.
+        parallel: If `True`, the files are written concurrently (on a thread pool), so that the total time approaches the time of the slowest file. The memory-heavy files (i.e., not streamed, or the image if it can be loaded in memory) are still written one at a time.
+        force: If `True`, all the files are written. Otherwise, the files whose inputs (elements, arguments and package version) didn't change since the last `write` in this directory are skipped (their fingerprints are saved in a manifest file).
+        points_per_tile: If not `None`, the tiles of the subsampled levels of the transcripts pyramid contain at most this number of transcripts (see `write_transcripts`).
     """
     path: Path = Path(path)
     _check_explorer_directory(path)
 
-    image_key, image = utils.get_spatial_image(sdata, image_key, return_key=True)
+    image_key, image = utils.get_spatial_image(sdata, image_key, return_key=True, multiscale=True)
+    plan = MemoryPlan(memory_budget_gb, parallel=parallel)
+    cache = BuildCache(path, force=force)
+    stages: list[Stage] = []
 
     ### Saving cell categories and gene counts
     if sdata.table is not None:
@@ -90,51 +117,183 @@ def write(
             ), f"Found only one region ({region[0]}), but `shapes_key` was provided with a different value ({shapes_key})"
             shapes_key = region[0]
 
-        if _should_save(mode, "c"):
-            write_gene_counts(path, adata, layer=layer)
-        if _should_save(mode, "o"):
-            write_cell_categories(path, adata)
+        counts = adata.X if layer is None else adata.layers[layer]
+        if _should_save(mode, "c") and cache.should_write(
+            FileNames.TABLE, counts, adata.obs_names, adata.var_names, compression
+        ):
+            streaming = plan.streaming("counts", counts_nbytes, adata, layer, default=None)
+            counts_writer = partial(
+                write_gene_counts,
+                path,
+                adata,
+                layer=layer,
+                compression=get_compression_policy(compression, FileNames.TABLE),
+                streaming=streaming,
+                staging_memory_gb=plan.staging_gb,
+            )
+            counts_writer = cache.wrap(FileNames.TABLE, counts_writer)
+            stages.append(Stage("counts", counts_writer, memory=streaming is not True))
+        del counts
+
+        if _should_save(mode, "o") and cache.should_write(
+            FileNames.CELL_CATEGORIES, adata.obs, compression
+        ):
+            categories = partial(
+                write_cell_categories,
+                path,
+                adata,
+                compression=get_compression_policy(compression, FileNames.CELL_CATEGORIES),
+                n_workers=n_workers,
+                staging_memory_gb=plan.staging_gb,
+            )
+            stages.append(Stage("categories", cache.wrap(FileNames.CELL_CATEGORIES, categories)))
 
     ### Saving cell boundaries
     shapes_key, geo_df = utils.get_element(sdata, "shapes", shapes_key, return_key=True)
-
-    if _should_save(mode, "b") and geo_df is not None:
-        geo_df = utils.to_intrinsic(sdata, geo_df, image_key)
-
-        if sdata.table is not None:
-            geo_df = geo_df.loc[adata.obs[adata.uns["spatialdata_attrs"]["instance_key"]]]
-
-        geo_df = utils._standardize_shapes(geo_df)
-
-        write_polygons(path, geo_df.geometry, polygon_max_vertices, pixel_size=pixel_size)
+    n_obs = _get_n_obs(sdata, geo_df)
+
+    if (
+        _should_save(mode, "b")
+        and geo_df is not None
+        and cache.should_write(
+            FileNames.SHAPES,
+            element_token(sdata, "shapes", shapes_key),
+            nucleus_key and element_token(sdata, "shapes", nucleus_key),
+            transformation_token(sdata, image_key),
+            _instance_ids(sdata),
+            polygon_max_vertices,
+            polygon_simplification,
+            pixel_size,
+            compression,
+        )
+    ):
+        streaming = plan.streaming("boundaries", polygons_nbytes, n_obs, polygon_max_vertices)
+        boundaries = partial(
+            _write_boundaries,
+            path,
+            sdata,
+            geo_df,
+            image_key,
+            nucleus_key,
+            polygon_max_vertices,
+            pixel_size=pixel_size,
+            compression=get_compression_policy(compression, FileNames.SHAPES),
+            simplification=polygon_simplification,
+            n_workers=n_workers,
+            streaming=streaming,
+            staging_memory_gb=plan.staging_gb,
+        )
+        boundaries = cache.wrap(FileNames.SHAPES, boundaries)
+        stages.append(
+            Stage("boundaries", boundaries, memory=not streaming, processes=n_workers > 1)
+        )
+    del geo_df
 
     ### Saving transcripts
     if spot and sdata.table is not None:
         df, gene_column = utils._spot_transcripts_origin(adata)
+        points_token = adata.var_names
     else:
-        df = utils.get_element(sdata, "points", points_key)
+        points_key, df = utils.get_element(sdata, "points", points_key, return_key=True)
         df = utils.to_intrinsic(sdata, df, image_key)
+        points_token = element_token(sdata, "points", points_key) if df is not None else None
 
     if _should_save(mode, "t") and df is not None:
-        if gene_column is not None:
-            write_transcripts(path, df, gene_column, pixel_size=pixel_size)
-        else:
+        if gene_column is None:
             log.warn("The argument 'gene_column' has to be provided to save the transcripts")
+        elif cache.should_write(
+            FileNames.POINTS,
+            points_token,
+            transformation_token(sdata, image_key),
+            gene_column,
+            pixel_size,
+            compression,
+            points_per_tile,
+        ):
+            streaming = plan.streaming("transcripts", transcripts_nbytes, df)
+            transcripts = partial(
+                write_transcripts,
+                path,
+                df,
+                gene_column,
+                pixel_size=pixel_size,
+                compression=get_compression_policy(compression, FileNames.POINTS),
+                n_workers=n_workers,
+                streaming=streaming,
+                staging_memory_gb=plan.staging_gb,
+                points_per_tile=points_per_tile,
+            )
+            transcripts = cache.wrap(FileNames.POINTS, transcripts)
+            stages.append(Stage("transcripts", transcripts, memory=not streaming))
+    del df
 
     ### Saving image
     if _should_save(mode, "i"):
-        write_image(
-            path, image, lazy=lazy, ram_threshold_gb=ram_threshold_gb, pixel_size=pixel_size
-        )
+        image_kwargs = plan.image_kwargs(image, lazy, ram_threshold_gb)
+        # the procedure is part of the fingerprint, since the lower levels depend on it
+        procedure = {name: value for name, value in image_kwargs.items() if name != "max_strip_gb"}
+
+        if cache.should_write(
+            FileNames.IMAGE,
+            element_token(sdata, "images", image_key),
+            pixel_size,
+            image_contrast,
+            procedure,
+        ):
+            in_memory = not image_kwargs.get("streaming") and (
+                not image_kwargs["lazy"] or image_kwargs["ram_threshold_gb"] is not None
+            )
+            image_writer = partial(
+                write_image,
+                path,
+                image,
+                pixel_size=pixel_size,
+                n_workers=n_workers,
+                contrast=image_contrast,
+                **image_kwargs,
+            )
+            image_writer = cache.wrap(FileNames.IMAGE, image_writer)
+            stages.append(Stage("image", image_writer, memory=in_memory))
+    del image
+
+    run_stages(stages, parallel=parallel)
 
     ### Saving experiment.xenium file
     if _should_save(mode, "m"):
-        write_metadata(path, image_key, shapes_key, _get_n_obs(sdata, geo_df), pixel_size)
+        write_metadata(path, image_key, shapes_key, n_obs, pixel_size)
 
+    plan.summary()
     log.info(f"Saved files in the following directory: {path}")
     log.info(f"You can open the experiment with 'open {path / FileNames.METADATA}'")
 
 
+def _write_boundaries(
+    path: Path,
+    sdata: SpatialData,
+    geo_df: gpd.GeoDataFrame,
+    image_key: str,
+    nucleus_key: str | None,
+    polygon_max_vertices: int,
+    **kwargs,
+) -> None:
+    geo_df = utils.to_intrinsic(sdata, geo_df, image_key)
+
+    if sdata.table is not None:
+        adata = sdata.table
+        geo_df = geo_df.loc[adata.obs[adata.uns["spatialdata_attrs"]["instance_key"]]]
+
+    geo_df = utils._standardize_shapes(geo_df, polygon_max_vertices)
+
+    nuclei = None
+    if nucleus_key is not None:
+        nuclei_df = utils.to_intrinsic(sdata, nucleus_key, image_key)
+        nuclei_df = utils._standardize_shapes(nuclei_df, polygon_max_vertices)
+        nuclei = match_nuclei(geo_df.geometry, nuclei_df.geometry)
+        del nuclei_df
+
+    write_polygons(path, geo_df.geometry, polygon_max_vertices, nuclei=nuclei, **kwargs)
+
+
 def _check_explorer_directory(path: Path):
     assert (
         not path.exists() or path.is_dir()
@@ -154,6 +313,12 @@ def _should_save(mode: str | None, character: str):
     return character in mode if mode[0] == "+" else character not in mode
 
 
+def _instance_ids(sdata: SpatialData):
+    if sdata.table is None:
+        return None
+    return sdata.table.obs[sdata.table.uns["spatialdata_attrs"]["instance_key"]].values
+
+
 def _get_n_obs(sdata: SpatialData, geo_df: gpd.GeoDataFrame) -> int:
     if sdata.table is not None:
         return sdata.table.n_obs
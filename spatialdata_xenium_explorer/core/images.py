@@ -2,8 +2,13 @@ from __future__ import annotations
 
 import logging
 import re
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from math import ceil
 from pathlib import Path
+from typing import Iterator
 
 import dask.array as da
 import numpy as np
@@ -22,17 +27,29 @@ from .._constants import ExplorerConstants, FileNames, image_metadata
 
 log = logging.getLogger(__name__)
 
+CONTRASTS = ["minmax", "percentile"]
+
 
 class MultiscaleImageWriter:
     photometric = "minisblack"
     compression = "jpeg2000"
     resolutionunit = "CENTIMETER"
     dtype = np.uint8
-
-    def __init__(self, image: MultiscaleSpatialImage, tile_width: int, pixel_size: float):
+    max_strip_bytes = 512 * 1024**2
+    contrast_percentiles = (0.5, 99.5)
+
+    def __init__(
+        self,
+        image: MultiscaleSpatialImage,
+        tile_width: int,
+        pixel_size: float,
+        n_existing_scales: int = 1,
+    ):
         self.image = image
         self.tile_width = tile_width
         self.pixel_size = pixel_size
+        # number of first scales of `image` that are read, the next ones are computed from the previous one
+        self.n_existing_scales = n_existing_scales
 
         self.scale_names = list(image.children)
         self.channel_names = list(map(str, image[self.scale_names[0]].c.values))
@@ -42,20 +59,80 @@ class MultiscaleImageWriter:
 
         self.lazy = True
         self.ram_threshold_gb = None
+        self.streaming = False
+        self.n_workers = 1
+        self.windows = None
 
-    def _n_tiles_axis(self, xarr: xr.DataArray, axis: int) -> int:
+    def _n_tiles_axis(self, xarr: xr.DataArray | np.ndarray, axis: int) -> int:
         return ceil(xarr.shape[axis] / self.tile_width)
 
-    def _get_tiles(self, xarr: xr.DataArray):
-        for c in range(xarr.shape[0]):
-            for index_y in range(self._n_tiles_axis(xarr, 1)):
-                for index_x in range(self._n_tiles_axis(xarr, 2)):
-                    tile = xarr[
-                        c,
+    def _get_tiles(
+        self,
+        xarr: xr.DataArray | np.ndarray,
+        reducer: _PyramidReducer | None = None,
+        scale: bool = True,
+    ) -> Iterator[np.ndarray]:
+        """Tiles of one level, read by strips (see `_strips`). If a `reducer` is provided, it also receives the strips to compute the lower scales. If `scale`, the tiles are converted to the output dtype."""
+        for c, strip in self._strips(xarr):
+            if reducer is not None:
+                reducer.add(c, strip)
+
+            for index_y in range(self._n_tiles_axis(strip, 0)):
+                for index_x in range(self._n_tiles_axis(strip, 1)):
+                    tile = strip[
                         self.tile_width * index_y : self.tile_width * (index_y + 1),
                         self.tile_width * index_x : self.tile_width * (index_x + 1),
-                    ].values
-                    yield self._scale(tile)
+                    ]
+                    yield self._scale(tile, c) if scale else tile
+
+    def _strips(self, xarr: xr.DataArray | np.ndarray) -> Iterator[tuple[int, np.ndarray]]:
+        """Read the image by strips of full tile rows, one channel at a time. The next strip is read in a background thread.
+
+        For a dask array, the strips are aligned on the chunks, so that each chunk is computed only once (if the strip size is below `max_strip_bytes`).
+        """
+        bounds = self._strip_bounds(xarr)
+        keys = [(c, y0, y1) for c in range(xarr.shape[0]) for y0, y1 in zip(bounds, bounds[1:])]
+
+        if not keys:
+            return
+
+        def read(key: tuple[int, int, int]) -> np.ndarray:
+            c, y0, y1 = key
+            return np.asarray(xarr[c, y0:y1])
+
+        with ThreadPoolExecutor(1) as executor:
+            future = executor.submit(read, keys[0])
+
+            for i, key in enumerate(keys):
+                strip = future.result()
+                if i + 1 < len(keys):
+                    future = executor.submit(read, keys[i + 1])
+
+                yield key[0], strip
+
+    def _strip_bounds(self, xarr: xr.DataArray | np.ndarray) -> list[int]:
+        height, width = xarr.shape[1:]
+        n_tile_rows = self._n_tiles_axis(xarr, 1)
+
+        data = xarr.data if isinstance(xarr, xr.DataArray) else xarr
+        if not isinstance(data, da.Array):
+            return [min(i * self.tile_width, height) for i in range(n_tile_rows + 1)]
+
+        # chunk boundaries, rounded up to the next tile row
+        chunk_bounds = np.cumsum(data.chunks[1])
+        bounds = {0} | {
+            min(ceil(b / self.tile_width) * self.tile_width, height) for b in chunk_bounds
+        }
+        bounds = sorted(bounds)
+
+        row_bytes = self.tile_width * width * xarr.dtype.itemsize
+        max_tile_rows = max(1, self.max_strip_bytes // row_bytes)
+
+        split_bounds = []  # strips above max_strip_bytes are split
+        for y0, y1 in zip(bounds, bounds[1:]):
+            split_bounds.extend(range(y0, y1, max_tile_rows * self.tile_width))
+
+        return split_bounds + [height]
 
     def _should_load_memory(self, shape: tuple[int, int, int], dtype: np.dtype):
         if not self.lazy:
@@ -69,26 +146,94 @@ class MultiscaleImageWriter:
 
         return size <= self.ram_threshold_gb * 1024**3
 
-    def _scale(self, array: np.ndarray):
-        return utils.scale_dtype(array, self.dtype)
+    def _scale(self, array: np.ndarray, channel: int) -> np.ndarray:
+        window = None if self.windows is None else self.windows[channel]
+        return utils.scale_dtype(array, self.dtype, window)
+
+    def _scale_channels(self, xarr: xr.DataArray) -> np.ndarray:
+        """Load and scale a full level, channel by channel (by blocks for a dask array)"""
+        if isinstance(xarr.data, da.Array):
+            channels = [
+                xarr.data[c].map_blocks(self._scale, c, dtype=self.dtype)
+                for c in range(xarr.shape[0])
+            ]
+            return da.stack(channels).compute()
+
+        return np.stack([self._scale(np.asarray(xarr.data[c]), c) for c in range(xarr.shape[0])])
+
+    def _contrast_windows(
+        self, contrast: str | list[tuple[float, float]] | None
+    ) -> list[tuple[float, float]] | None:
+        """Contrast window of each channel, computed on the smallest scale of the pyramid
 
-    def _write_image_level(self, tif: tf.TiffWriter, scale_index: int, **kwargs):
+        Note:
+            The windows are needed before writing the first tile. If the smallest scale is not an existing scale of the image (see `_to_explorer_multiscale`), computing it reads the full-resolution image once more, including with the streaming procedure.
+        """
+        if contrast is None:
+            return None
+
+        if not isinstance(contrast, str):
+            return [(float(low), float(high)) for low, high in contrast]
+
+        assert contrast in CONTRASTS, f"Invalid contrast {contrast}. Choose one of {CONTRASTS}"
+
+        if self.streaming:
+            log.info(
+                "Computing the contrast windows on the smallest scale (this reads the image once more if this scale has to be computed)"
+            )
+
+        xarr: xr.DataArray = next(iter(self.image[self.scale_names[-1]].values()))
+        windows = []
+        for c in range(xarr.shape[0]):
+            values = np.asarray(xarr[c])
+            if contrast == "minmax":
+                low, high = values.min(), values.max()
+            else:
+                low, high = np.percentile(values, self.contrast_percentiles)
+            windows.append((float(low), float(high)))
+
+        log.info(f"Contrast window of each channel: {windows}")
+        return windows
+
+    def _write_image_level(
+        self,
+        tif: tf.TiffWriter,
+        scale_index: int,
+        reducer: _PyramidReducer | None = None,
+        **kwargs,
+    ):
         xarr: xr.DataArray = next(iter(self.image[self.scale_names[scale_index]].values()))
         resolution = 1e4 * 2**scale_index / self.pixel_size
 
-        if not self._should_load_memory(xarr.shape, xarr.dtype):
+        if reducer is not None:
+            n_tiles = xarr.shape[0] * self._n_tiles_axis(xarr, 1) * self._n_tiles_axis(xarr, 2)
+            # the reducer computes the scales following the last existing one
+            reducer_index = scale_index - (self.n_existing_scales - 1)
+            if reducer_index < 0:
+                data = self._get_tiles(xarr)
+            elif reducer_index == 0:
+                data = self._get_tiles(xarr, reducer)
+            else:
+                data = self._get_tiles(reducer.scales[reducer_index])
+            data = iter(tqdm(data, total=n_tiles - 1, desc="Writing tiles"))
+        elif not self._should_load_memory(xarr.shape, xarr.dtype):
             n_tiles = xarr.shape[0] * self._n_tiles_axis(xarr, 1) * self._n_tiles_axis(xarr, 2)
             data = self._get_tiles(xarr)
             data = iter(tqdm(data, total=n_tiles - 1, desc="Writing tiles"))
         else:
-            if self.data is not None:
+            if self.data is not None and scale_index >= self.n_existing_scales:
                 self.data = utils.resize_numpy(self.data, 2, xarr.dims, xarr.shape)
             else:
                 log.info(f"   (Loading image of shape {xarr.shape}) in memory")
-                self.data = self._scale(xarr.values)
+                self.data = self._scale_channels(xarr)
 
             data = self.data
 
+        if self.n_workers > 1:
+            if isinstance(data, np.ndarray):
+                data = self._get_tiles(data, scale=False)
+            data = _encode_tiles(data, self.tile_width, self.n_workers)
+
         log.info(f"   > Image of shape {xarr.shape}")
         tif.write(
             data,
@@ -107,23 +252,150 @@ class MultiscaleImageWriter:
         return len(self.scale_names)
 
     def procedure(self):
+        if self.streaming:
+            return "streaming (single read of the image, lower scales stored on disk)"
         if not self.lazy:
             return "in-memory (consider lazy procedure if it crashes because of RAM)"
         if self.ram_threshold_gb is None:
             return "lazy (slower but low RAM usage)"
         return "semi-lazy (load in memory when possible)"
 
-    def write(self, path, lazy=True, ram_threshold_gb=None):
+    def write(
+        self,
+        path,
+        lazy=True,
+        ram_threshold_gb=None,
+        streaming=False,
+        n_workers=1,
+        contrast=None,
+        max_strip_bytes=None,
+    ):
         self.lazy = lazy
         self.ram_threshold_gb = ram_threshold_gb
+        self.streaming = streaming
+        self.n_workers = n_workers
+        self.windows = self._contrast_windows(contrast)
+
+        if max_strip_bytes is not None:
+            self.max_strip_bytes = max_strip_bytes
+
+        if self.windows is not None:
+            assert len(self.windows) == len(
+                self.channel_names
+            ), f"One contrast window per channel is required, found {len(self.windows)} for {len(self.channel_names)} channels"
 
         log.info(f"Writing multiscale image with procedure={self.procedure()}")
 
-        with tf.TiffWriter(path, bigtiff=True) as tif:
-            self._write_image_level(tif, 0, subifds=len(self) - 1)
+        tmp_dir = (
+            tempfile.TemporaryDirectory(prefix=".image_", dir=Path(path).parent)
+            if self.streaming
+            else nullcontext()
+        )
+
+        with tmp_dir, tf.TiffWriter(path, bigtiff=True) as tif:
+            reducer = self._pyramid_reducer(Path(tmp_dir.name)) if self.streaming else None
+
+            try:
+                self._write_image_level(tif, 0, reducer, subifds=len(self) - 1)
+
+                for i in range(1, len(self)):
+                    self._write_image_level(tif, i, reducer, subfiletype=1)
+            finally:
+                if reducer is not None:
+                    reducer.close()
+
+    def _pyramid_reducer(self, tmp_dir: Path) -> _PyramidReducer:
+        scale_names = self.scale_names[self.n_existing_scales - 1 :]
+        xarrs = [next(iter(self.image[scale_name].values())) for scale_name in scale_names]
+        return _PyramidReducer([xarr.shape for xarr in xarrs], xarrs[0].dtype, tmp_dir)
+
+
+def _encode_tiles(tiles: Iterator[np.ndarray], tile_width: int, n_workers: int) -> Iterator[bytes]:
+    """Encode the tiles in a pool of threads, and yield them in their original order. At most `2 * n_workers` tiles are read in advance."""
+    with ThreadPoolExecutor(n_workers) as executor:
+        pending = deque()
 
-            for i in range(1, len(self)):
-                self._write_image_level(tif, i, subfiletype=1)
+        for tile in tiles:
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_encode_tile, tile, tile_width))
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def _encode_tile(tile: np.ndarray, tile_width: int) -> bytes:
+    """Same JPEG2000 encoding as `tifffile` (padded tile, with one sample per pixel, and a J2K codestream instead of a JP2 file)"""
+    import imagecodecs
+
+    tile = np.ascontiguousarray(tile)
+    tile = np.pad(tile, ((0, tile_width - tile.shape[0]), (0, tile_width - tile.shape[1])))
+    return imagecodecs.jpeg2k_encode(tile[..., None], codecformat=0)  # 0 is OPJ_CODEC_J2K
+
+
+class _PyramidReducer:
+    """Computes the lower scales of a pyramid from the strips of rows of its level 0 (read only once), by 2x2 block-mean. Each scale is stored in a memory-mapped file until it is written.
+
+    The result is the same as `to_multiscale` with scale factors of 2, i.e. a chained `coarsen(boundary="trim", side="right").mean()`: if a size is odd, the first row (or column) is dropped.
+    """
+
+    def __init__(self, shapes: list[tuple[int, int, int]], dtype: np.dtype, tmp_dir: Path):
+        for previous, shape in zip(shapes[:-1], shapes[1:]):
+            assert shape[1:] == (
+                previous[1] // 2,
+                previous[2] // 2,
+            ), f"Streaming procedure requires scale factors of 2, found shapes {previous} and {shape}"
+
+        self.shapes = shapes
+        self.dtype = dtype
+        self.scales: list[np.ndarray | None] = [None] + [
+            np.memmap(tmp_dir / f"scale{i}.dat", dtype=dtype, mode="w+", shape=shape)
+            for i, shape in enumerate(shapes[1:], start=1)
+        ]
+        self.channel = None
+
+    def close(self) -> None:
+        """Release the memory-mapped scales, so that their files can be removed (open files can't be removed on Windows)"""
+        self.scales = [None] * len(self.shapes)
+
+    def _reset(self, channel: int) -> None:
+        self.channel = channel
+        self.pending = [None] * len(self.shapes)  # remaining row (if odd number of rows)
+        self.rows_to_skip = [shape[1] % 2 for shape in self.shapes]
+        self.next_row = [0] * len(self.shapes)
+
+    def add(self, channel: int, rows: np.ndarray, scale_index: int = 0) -> None:
+        """Add the next rows of scale `scale_index` for one channel, and compute the rows of the following scales"""
+        if scale_index + 1 == len(self.shapes):
+            return
+
+        if channel != self.channel:
+            self._reset(channel)
+
+        skip = min(self.rows_to_skip[scale_index], len(rows))
+        self.rows_to_skip[scale_index] -= skip
+        rows = rows[skip:]
+
+        if self.pending[scale_index] is not None:
+            rows = np.concatenate([self.pending[scale_index], rows])
+
+        n_rows = len(rows) // 2 * 2
+        self.pending[scale_index] = rows[n_rows:] if n_rows < len(rows) else None
+
+        if not n_rows:
+            return
+
+        _, height, width = self.shapes[scale_index + 1]
+        x_offset = self.shapes[scale_index][2] % 2
+
+        blocks = rows[:n_rows, x_offset : x_offset + 2 * width]
+        blocks = blocks.reshape(n_rows // 2, 2, width, 2).mean(axis=(1, 3)).astype(self.dtype)
+
+        start = self.next_row[scale_index + 1]
+        self.scales[scale_index + 1][channel, start : start + len(blocks)] = blocks
+        self.next_row[scale_index + 1] += len(blocks)
+
+        self.add(channel, blocks, scale_index + 1)
 
 
 def _default_image_models_kwargs(image_models_kwargs: dict | None):
@@ -168,25 +440,33 @@ def _set_colors(channel_names: list[str]) -> list[str]:
 
 def write_image(
     path: str,
-    image: SpatialImage | np.ndarray,
+    image: SpatialImage | MultiscaleSpatialImage | np.ndarray,
     lazy: bool = True,
     tile_width: int = 1024,
     n_subscales: int = 5,
     pixel_size: float = 0.2125,
     ram_threshold_gb: int | None = 4,
     is_dir: bool = True,
+    streaming: bool = False,
+    n_workers: int = 1,
+    contrast: str | list[tuple[float, float]] | None = None,
+    max_strip_gb: float | None = None,
 ):
     """Convert an image into a `morphology.ome.tif` file that can be read by the Xenium Explorer
 
     Args:
         path: Path to the Xenium Explorer directory where the image will be written
-        image: Image of shape `(C, Y, X)`
+        image: Image of shape `(C, Y, X)`. If it is a `MultiscaleSpatialImage`, its existing scales are reused when compatible with the Explorer pyramid (i.e., each scale is 2 times smaller than the previous one), and only the missing scales are computed.
         lazy: If `False`, the image will not be read in-memory (except if the image size is below `ram_threshold_gb`). If `True`, all the images levels are always loaded in-memory.
         tile_width: Xenium tile width (do not update).
         n_subscales: Number of sub-scales in the pyramidal image.
         pixel_size: Xenium pixel size (do not update).
         ram_threshold_gb: If an image (of any level of the pyramid) is below this threshold, it will be loaded in-memory.
         is_dir: If `False`, then `path` is a path to a single file, not to the Xenium Explorer directory.
+        streaming: If `True`, the full-resolution image is read only once (by strips of tiles), and all the sub-scales are computed while writing it, then stored on disk until they are written. This ignores `lazy` and `ram_threshold_gb`, and gives the same sub-scales as the default procedure (see `contrast` for the only exception to the single read).
+        n_workers: Number of threads used to encode the JPEG2000 tiles while the next tiles are read. If `1`, the tiles are encoded by `tifffile`.
+        contrast: By default, the values are scaled according to the maximum value of the image dtype (e.g., `65535` becomes `255` for a `uint16` image). Use `"minmax"` or `"percentile"` to scale each channel according to its min/max values or its `(0.5, 99.5)` percentiles (computed on the smallest scale), or provide one `(low, high)` window per channel. Note that `"minmax"` and `"percentile"` read the full-resolution image once more if the smallest scale is not an existing scale of `image` (also when `streaming=True`).
+        max_strip_gb: Maximum size (in gigabytes) of a strip of tiles read at once when a level is not loaded in memory. Two strips can be in memory (the one being written, and the next one read in the background). By default, 0.5 GB. A strip contains at least one row of tiles.
     """
     path = utils.explorer_file_path(path, FileNames.IMAGE, is_dir)
 
@@ -195,10 +475,65 @@ def write_image(
         log.info(f"Converting image of shape {image.shape} into a SpatialImage (with dims: C,Y,X)")
         image = SpatialImage(image, dims=["c", "y", "x"], name="image")
 
-    image: MultiscaleSpatialImage = to_multiscale(image, [2] * n_subscales)
+    image, n_existing_scales = _to_explorer_multiscale(image, n_subscales)
+
+    image_writer = MultiscaleImageWriter(
+        image, pixel_size=pixel_size, tile_width=tile_width, n_existing_scales=n_existing_scales
+    )
+    image_writer.write(
+        path,
+        lazy=lazy,
+        ram_threshold_gb=ram_threshold_gb,
+        streaming=streaming,
+        n_workers=n_workers,
+        contrast=contrast,
+        max_strip_bytes=None if max_strip_gb is None else int(max_strip_gb * 1024**3),
+    )
+
+
+def _to_explorer_multiscale(
+    image: SpatialImage | MultiscaleSpatialImage, n_subscales: int
+) -> tuple[MultiscaleSpatialImage, int]:
+    """Pyramid of `n_subscales + 1` scales, reusing the compatible scales of an existing pyramid, and the number of reused scales"""
+    if isinstance(image, MultiscaleSpatialImage):
+        scales = _reusable_scales(image, n_subscales + 1)
+    else:
+        scales = [image]
+
+    n_missing = n_subscales + 1 - len(scales)
+
+    if isinstance(image, MultiscaleSpatialImage):
+        log.info(f"Reusing {len(scales)} existing image scale(s), computing {n_missing} scale(s)")
+
+    if n_missing:
+        # coarsening the smallest scale gives the same shapes as coarsening scale0 (floor division)
+        missing = to_multiscale(SpatialImage(scales[-1]), [2] * n_missing)
+        scales += [next(iter(missing[name].values())) for name in list(missing.children)[1:]]
+
+    multiscale = MultiscaleSpatialImage.from_dict(
+        {f"scale{i}": xr.Dataset({"image": scale}) for i, scale in enumerate(scales)}
+    )
+    return multiscale, n_subscales + 1 - n_missing
+
+
+def _reusable_scales(image: MultiscaleSpatialImage, max_scales: int) -> list[xr.DataArray]:
+    """First scales of the pyramid such that each scale is 2 times smaller than the previous one"""
+    scales = [next(iter(image[name].values())) for name in image.children]
+    reusable = scales[:1]
+
+    for scale in scales[1:max_scales]:
+        previous = reusable[-1]
+        expected_shape = previous.shape[:-2] + tuple(size // 2 for size in previous.shape[-2:])
+
+        if scale.dims != previous.dims or scale.shape != expected_shape:
+            log.info(
+                f"Image scale of shape {scale.shape} is not 2 times smaller than {previous.shape}. The next scales will be computed."
+            )
+            break
+
+        reusable.append(scale)
 
-    image_writer = MultiscaleImageWriter(image, pixel_size=pixel_size, tile_width=tile_width)
-    image_writer.write(path, lazy=lazy, ram_threshold_gb=ram_threshold_gb)
+    return reusable
 
 
 def align(
@@ -1,20 +1,59 @@
+from __future__ import annotations
+
 import logging
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
 from pathlib import Path
+from typing import Iterator
 
+import dask
 import dask.dataframe as dd
 import numpy as np
+import pandas as pd
 import zarr
+from tqdm import tqdm
 
-from .._constants import ExplorerConstants, FileNames
+from .._compression import CompressionPolicy, get_compression_policy
+from .._constants import ExplorerConstants, FileNames, PointsConstants
+from .._store import DEFAULT_STAGING_MEMORY_GB, explorer_store
 from ..utils import explorer_file_path
 
 log = logging.getLogger(__name__)
 
+N_SHUFFLE_ROUNDS = 4
+
+
+def _tiles_locations(
+    location: np.ndarray, tile_size: float, n_tiles_x: int, n_tiles_y: int
+) -> Iterator[tuple[str, np.ndarray]]:
+    """Group the transcripts per tile, using one sort on a linear tile index
+
+    Args:
+        location: Array of shape `(n_transcripts, 2+)` with the transcripts coordinates (in microns)
+        tile_size: Width of a tile (in microns)
+        n_tiles_x: Number of tiles along the x axis
+        n_tiles_y: Number of tiles along the y axis
+
+    Yields:
+        For each non-empty tile (ordered by `x` index, then `y` index), a tuple `(str_index, loc)` where `loc` contains the (increasing) indices of the transcripts inside the tile
+    """
+    n_tiles = n_tiles_x * n_tiles_y
+
+    tiles_indices = np.floor(location[:, :2] / tile_size).clip(0).astype(np.int64)
+    tile_ids = tiles_indices[:, 0] * n_tiles_y + tiles_indices[:, 1]
+
+    outside = (tiles_indices[:, 0] >= n_tiles_x) | (tiles_indices[:, 1] >= n_tiles_y)
+    tile_ids[outside] = n_tiles  # transcripts outside of the grid are not written
 
-def subsample_indices(n_samples, factor: int = 4):
-    n_sub = n_samples // factor
-    return np.random.choice(n_samples, n_sub, replace=False)
+    order = np.argsort(tile_ids, kind="stable")
+    counts = np.bincount(tile_ids, minlength=n_tiles + 1)[:n_tiles]
+    ends = np.cumsum(counts)
+
+    for tile_id in np.flatnonzero(counts):
+        tx, ty = divmod(int(tile_id), n_tiles_y)
+        yield f"{tx},{ty}", order[ends[tile_id] - counts[tile_id] : ends[tile_id]]
 
 
 def write_transcripts(
@@ -24,50 +63,237 @@ def write_transcripts(
     max_levels: int = 15,
     is_dir: bool = True,
     pixel_size: float = 0.2125,
+    streaming: bool = False,
+    seed: int | None = 0,
+    n_workers: int = 1,
+    points_per_tile: int | None = None,
+    compression: str | dict | CompressionPolicy = "default",
+    staging_memory_gb: float = DEFAULT_STAGING_MEMORY_GB,
 ):
     """Write a `transcripts.zarr.zip` file containing pyramidal transcript locations
 
     Args:
         path: Path to the Xenium Explorer directory where the transcript file will be written
-        df: DataFrame representing the transcripts, with `"x"`, `"y"` column required, as well as the `gene` column (see the corresponding argument)
+        df: DataFrame representing the transcripts, with `"x"`, `"y"` column required, as well as the `gene` column (see the corresponding argument). If present, the `"z"` (in microns), `"qv"` and `"transcript_id"` columns are also written.
         gene: Column of `df` containing the genes names.
         max_levels: Maximum number of levels in the pyramid.
         is_dir: If `False`, then `path` is a path to a single file, not to the Xenium Explorer directory.
         pixel_size: Number of microns in a pixel. Invalid value can lead to inconsistent scales in the Explorer.
+        streaming: If `True`, the transcripts are never fully loaded in memory: each dask partition is spilled on disk into per-tile buckets, and each tile is then written from its buckets. Use it when the transcripts don't fit in memory.
+        seed: Seed of the random subsampling of the pyramid levels. Using the same seed leads to identical outputs, with or without `streaming`. If `None`, the subsampling is not reproducible.
+        n_workers: Number of threads used to encode the tiles (the encoded tiles are then packed into the zip file in the same order as with one worker).
+        points_per_tile: If not `None`, the tiles of the subsampled levels (i.e., all levels except the first one) contain at most this number of transcripts, using stratified sampling inside the tiles. It makes the Explorer faster on dense regions, and the output file smaller.
+        compression: Compressor of each array: one of `"default"`, `"none"`, `"balanced"`, `"compact"`, or a dictionary of compressors per array name (see `CompressionPolicy`).
+        staging_memory_gb: Size (in gigabytes) of the encoded arrays kept in memory before being spilled to a temporary file, until the `.zarr.zip` file is packed (see `explorer_store`).
     """
     path = explorer_file_path(path, FileNames.POINTS, is_dir)
+    compressor = get_compression_policy(compression)
+
+    if streaming:
+        _write_transcripts_streaming(
+            path,
+            df,
+            gene,
+            max_levels,
+            pixel_size,
+            seed,
+            n_workers,
+            points_per_tile,
+            compressor,
+            staging_memory_gb,
+        )
+        return
 
-    # TODO: make everything using dask instead of pandas
     df = df.compute()
 
     num_transcripts = len(df)
-    grid_size = ExplorerConstants.GRID_SIZE / ExplorerConstants.PIXELS_TO_MICRONS * pixel_size
+    grid_size = _grid_size(pixel_size)
     df[gene] = df[gene].astype("category")
 
-    location = df[["x", "y"]]
-    location *= pixel_size
-    location = np.concatenate([location, np.zeros((num_transcripts, 1))], axis=1)
+    location = np.asarray(df[["x", "y"]] * pixel_size, dtype=np.float64)
 
     if location.min() < 0:
         log.warn("Some transcripts are located outside of the image (pixels < 0)")
     log.info(f"Writing {len(df)} transcripts")
 
-    xmax, ymax = location[:, :2].max(axis=0)
+    xmax, ymax = location.max(axis=0)
 
     gene_names = list(df[gene].cat.categories)
-    num_genes = len(gene_names)
 
-    codeword_gene_mapping = list(range(num_genes))
+    # the transcripts are shuffled once: the level `k` is a view on the first N / 4**k transcripts
+    order = _shuffled_order(num_transcripts, _shuffle_keys(seed))
+
+    columns = {
+        "location": location[order],
+        "gene_identity": df[gene].cat.codes.values[order].astype(np.uint16),
+        "id": order.astype(np.uint32),
+    }
+
+    if _has_transcript_ids(df, *_ids_bounds(df)):
+        columns["id"] = df[PointsConstants.TRANSCRIPT_ID].values[order].astype(np.uint32)
+
+    for name in _optional_columns(df):
+        columns[name] = df[name].values[order].astype(np.float32)
+
+    del location, order
+
+    GRIDS_ATTRS = _grids_attrs(grid_size)
+
+    with explorer_store(path, staging_memory_gb) as store, _TilesWriter(
+        n_workers, compressor
+    ) as tiles_writer:
+        g = zarr.group(store=store)
+        g.attrs.put(_transcripts_attrs(gene_names, num_transcripts))
+
+        grids = g.create_group("grids")
+
+        for level in range(max_levels):
+            n_level = num_transcripts // 4**level
+            level_group = grids.create_group(level)
+
+            tile_size = grid_size * 2**level
+
+            GRIDS_ATTRS["grid_array_shapes"].append([])
+            GRIDS_ATTRS["grid_number_objects"].append([])
+            GRIDS_ATTRS["grid_keys"].append([])
+
+            n_tiles_x, n_tiles_y = max(1, ceil(xmax / tile_size)), max(1, ceil(ymax / tile_size))
+
+            n_capped = 0
+            for str_index, loc in _tiles_locations(
+                columns["location"][:n_level], tile_size, n_tiles_x, n_tiles_y
+            ):
+                if level > 0 and points_per_tile is not None:
+                    n_capped += len(loc) > points_per_tile
+                    loc = _cap_tile(loc, columns["location"], tile_size, points_per_tile)
+
+                tile_arrays = _tile_arrays({name: column[loc] for name, column in columns.items()})
+                tiles_writer.write(level_group, str_index, tile_arrays, GRIDS_ATTRS)
+
+            _log_level(level, GRIDS_ATTRS["grid_number_objects"][-1], n_capped)
+
+            if n_tiles_x * n_tiles_y == 1 and level > 0:
+                GRIDS_ATTRS["number_levels"] = level + 1
+                break
+
+        grids.attrs.put(GRIDS_ATTRS)
+
+
+def _shuffle_keys(seed: int | None) -> np.ndarray:
+    return np.random.default_rng(seed).integers(
+        np.iinfo(np.uint64).max, size=N_SHUFFLE_ROUNDS, dtype=np.uint64
+    )
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer (the multiplications wrap around on purpose)
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _shuffle_ranks(indices: np.ndarray, num_transcripts: int, keys: np.ndarray) -> np.ndarray:
+    """Position of each transcript in a random permutation of `range(num_transcripts)`
+
+    The permutation is a keyed Feistel network (restricted to `range(num_transcripts)` by cycle-walking), so the rank of a transcript only depends on its index: the transcripts can be shuffled partition by partition, and the streaming and in-memory modes shuffle them identically.
+
+    Args:
+        indices: Indices of the transcripts (between `0` and `num_transcripts - 1`)
+        num_transcripts: Total number of transcripts
+        keys: Keys of the Feistel rounds (see `_shuffle_keys`)
+
+    Returns:
+        The ranks of the transcripts, as an array of `uint64`
+    """
+    n_bits = max(2, (num_transcripts - 1).bit_length())  # permutation of range(2**n_bits)
+
+    def permute(x: np.ndarray) -> np.ndarray:
+        right_bits = n_bits // 2
+        for key in keys:  # (unbalanced) rounds: the halves widths are swapped at each round
+            left_bits = n_bits - right_bits
+            left, right = x >> np.uint64(right_bits), x & np.uint64((1 << right_bits) - 1)
+            left ^= _mix(right ^ key) & np.uint64((1 << left_bits) - 1)
+            x = (right << np.uint64(left_bits)) | left
+            right_bits = left_bits
+        return x
+
+    ranks = permute(np.asarray(indices, dtype=np.uint64))
+    outside = np.flatnonzero(ranks >= num_transcripts)
+    while len(outside):
+        ranks[outside] = permute(ranks[outside])
+        outside = outside[ranks[outside] >= num_transcripts]
+
+    return ranks
+
+
+def _shuffled_order(num_transcripts: int, keys: np.ndarray, chunk_size: int = 2**16) -> np.ndarray:
+    """Indices of the transcripts, sorted by their rank (i.e., the inverse of `_shuffle_ranks`)"""
+    order = np.empty(num_transcripts, dtype=np.int64)
+    for start in range(0, num_transcripts, chunk_size):
+        indices = np.arange(start, min(start + chunk_size, num_transcripts))
+        order[_shuffle_ranks(indices, num_transcripts, keys)] = indices
+    return order
+
+
+def _cap_tile(
+    loc: np.ndarray, location: np.ndarray, tile_size: float, points_per_tile: int, n_strata: int = 4
+) -> np.ndarray:
+    """Keep at most `points_per_tile` transcripts of a tile, by stratified sampling
+
+    The tile is divided into `n_strata x n_strata` cells, and each cell keeps a number of transcripts proportional to its density. Inside a cell, the first transcripts are kept, so `loc` is expected to be in a random order.
+
+    Args:
+        loc: Indices of the transcripts of the tile (in a random order)
+        location: Array of shape `(n_transcripts, 2+)` with the transcripts coordinates (in microns)
+        tile_size: Width of a tile (in microns)
+        points_per_tile: Maximum number of transcripts in the tile
+        n_strata: Number of cells along each axis used for the stratification
+
+    Returns:
+        The (sorted) subset of `loc` that is kept
+    """
+    n_points_tile = len(loc)
+    if n_points_tile <= points_per_tile:
+        return loc
+
+    cells = np.floor(location[loc, :2] / (tile_size / n_strata)).astype(np.int64) % n_strata
+    strata = cells[:, 0] * n_strata + cells[:, 1]
+
+    order = np.argsort(strata, kind="stable")
+    counts = np.bincount(strata, minlength=n_strata**2)
+    starts = np.cumsum(counts) - counts
+
+    ranks = np.empty(n_points_tile, dtype=np.int64)
+    ranks[order] = np.arange(n_points_tile) - starts[strata[order]]
+
+    # the i-th transcript of a cell is kept if i / cell_size is among the `points_per_tile` smallest
+    kept = np.argsort(ranks / counts[strata], kind="stable")[:points_per_tile]
+    return loc[np.sort(kept)]
+
+
+def _log_level(level: int, grid_number_objects: list[int], n_capped: int) -> None:
+    """Report the number of transcripts of a level, its distribution per tile, and the number of tiles capped by `points_per_tile` (i.e., that lost transcripts)"""
+    counts = np.array(grid_number_objects)
 
-    valid = np.ones((num_transcripts, 1))
-    uuid = np.stack([np.arange(num_transcripts), np.full(num_transcripts, 65535)], axis=1)
-    transcript_id = np.stack([np.arange(num_transcripts), np.full(num_transcripts, 65535)], axis=1)
-    gene_identity = df[gene].cat.codes.values[:, None]
-    codeword_identity = np.stack([gene_identity[:, 0], np.full(num_transcripts, 65535)], axis=1)
-    status = np.zeros((num_transcripts, 1))
-    quality_score = np.full((num_transcripts, 1), ExplorerConstants.QUALITY_SCORE)
+    if not len(counts):
+        log.info(f"   > Level {level}: 0 transcripts")
+        return
 
-    ATTRS = {
+    log.info(
+        f"   > Level {level}: {counts.sum()} transcripts in {len(counts)} tiles (per tile: min={counts.min()}, median={int(np.median(counts))}, max={counts.max()}, {n_capped} capped)"
+    )
+
+
+def _grid_size(pixel_size: float) -> float:
+    return ExplorerConstants.GRID_SIZE / ExplorerConstants.PIXELS_TO_MICRONS * pixel_size
+
+
+def _transcripts_attrs(gene_names: list[str], num_transcripts: int) -> dict:
+    num_genes = len(gene_names)
+    codeword_gene_mapping = list(range(num_genes))
+
+    return {
         "codeword_count": num_genes,
         "codeword_gene_mapping": codeword_gene_mapping,
         "codeword_gene_names": gene_names,
@@ -84,7 +310,9 @@ def write_transcripts(
         "data_format": 0,
     }
 
-    GRIDS_ATTRS = {
+
+def _grids_attrs(grid_size: float) -> dict:
+    return {
         "grid_key_names": ["grid_x_loc", "grid_y_loc"],
         "grid_zip": False,
         "grid_size": [grid_size],
@@ -93,105 +321,377 @@ def write_transcripts(
         "grid_keys": [],
     }
 
-    with zarr.ZipStore(path, mode="w") as store:
-        g = zarr.group(store=store)
-        g.attrs.put(ATTRS)
 
-        grids = g.create_group("grids")
+TILE_ARRAYS_DTYPES = {
+    "valid": "uint8",
+    "status": "uint8",
+    "location": "float32",
+    "gene_identity": "uint16",
+    "quality_score": "float32",
+    "codeword_identity": "uint16",
+    "uuid": "uint32",
+    "id": "uint32",
+}
 
-        for level in range(max_levels):
-            log.info(f"   > Level {level}: {len(location)} transcripts")
-            level_group = grids.create_group(level)
 
-            tile_size = grid_size * 2**level
+class _TilesWriter:
+    """Write the tile groups of the transcripts, with the tile arrays encoded either serially or in a pool of threads
 
-            indices = np.floor(location[:, :2] / tile_size).clip(0).astype(int)
-            tiles_str_indices = np.array([f"{tx},{ty}" for (tx, ty) in indices])
+    The encoded tiles are copied into the store in the calling thread and in the submission order, so the output doesn't depend on `n_workers`
+    """
 
-            GRIDS_ATTRS["grid_array_shapes"].append([])
-            GRIDS_ATTRS["grid_number_objects"].append([])
-            GRIDS_ATTRS["grid_keys"].append([])
+    def __init__(self, n_workers: int = 1, compressor: CompressionPolicy | None = None):
+        self.n_workers = n_workers
+        self.compressor = get_compression_policy(compressor)
+        self.executor = ThreadPoolExecutor(n_workers) if n_workers > 1 else None
+        self.pending = deque()
+
+    def write(
+        self,
+        level_group: zarr.Group,
+        str_index: str,
+        tile_arrays: dict[str, np.ndarray],
+        grids_attrs: dict,
+    ) -> None:
+        n_points_tile = len(tile_arrays["location"])
+
+        grids_attrs["grid_array_shapes"][-1].append({})
+        grids_attrs["grid_keys"][-1].append(str_index)
+        grids_attrs["grid_number_objects"][-1].append(n_points_tile)
+
+        tile_group = level_group.create_group(str_index)
+
+        if self.executor is None:
+            _copy_encoded(tile_group, _encode_tile_arrays(tile_arrays, self.compressor))
+            return
+
+        while len(self.pending) >= 2 * self.n_workers:  # bounds the number of tiles in memory
+            self._flush_one()
+
+        future = self.executor.submit(_encode_tile_arrays, tile_arrays, self.compressor)
+        self.pending.append((tile_group, future))
+
+    def _flush_one(self):
+        tile_group, future = self.pending.popleft()
+        _copy_encoded(tile_group, future.result())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.executor is None:
+            return
+
+        try:
+            while self.pending and exc_type is None:
+                self._flush_one()
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _encode_tile_arrays(
+    tile_arrays: dict[str, np.ndarray], compressor: CompressionPolicy
+) -> dict[str, bytes]:
+    """Encode the arrays of one tile into an in-memory store (the keys are relative to the tile group)"""
+    buffer = {}
+    chunks = (len(tile_arrays["location"]), 1)
+
+    for name, dtype in TILE_ARRAYS_DTYPES.items():
+        zarr.array(
+            tile_arrays[name],
+            dtype=dtype,
+            chunks=chunks,
+            store=buffer,
+            path=name,
+            compressor=compressor(name, tile_arrays[name], dtype),
+        )
+
+    return buffer
+
+
+def _copy_encoded(tile_group: zarr.Group, buffer: dict[str, bytes]) -> None:
+    for key, value in buffer.items():
+        tile_group.store[f"{tile_group.path}/{key}"] = value
+
+
+def _tile_arrays(columns: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Build the arrays of one tile (in their final dtype) from its compact per-transcript columns"""
+    n_points_tile = len(columns["location"])
+
+    location = np.zeros((n_points_tile, 3), dtype=np.float32)
+    location[:, :2] = columns["location"]
+    if PointsConstants.Z in columns:
+        location[:, 2] = columns[PointsConstants.Z]
+
+    if PointsConstants.QUALITY_SCORE in columns:
+        quality_score = columns[PointsConstants.QUALITY_SCORE][:, None]
+    else:
+        quality_score = _constant_column(ExplorerConstants.QUALITY_SCORE, n_points_tile, np.float32)
+
+    codeword_identity = np.empty((n_points_tile, 2), dtype=np.uint16)
+    codeword_identity[:, 0] = columns["gene_identity"]
+    codeword_identity[:, 1] = 65535
+
+    transcript_id = np.empty((n_points_tile, 2), dtype=np.uint32)
+    transcript_id[:, 0] = columns["id"]
+    transcript_id[:, 1] = 65535
+
+    return {
+        "valid": _constant_column(1, n_points_tile, np.uint8),
+        "status": _constant_column(0, n_points_tile, np.uint8),
+        "location": location,
+        "gene_identity": columns["gene_identity"][:, None],
+        "quality_score": quality_score,
+        "codeword_identity": codeword_identity,
+        "uuid": transcript_id,
+        "id": transcript_id,
+    }
 
-            n_tiles_x, n_tiles_y = max(1, ceil(xmax / tile_size)), max(1, ceil(ymax / tile_size))
 
-            for tx in range(n_tiles_x):
-                for ty in range(n_tiles_y):
-                    str_index = f"{tx},{ty}"
-                    loc = np.where(tiles_str_indices == str_index)[0]
+def _constant_column(value: float, n_points_tile: int, dtype: np.dtype) -> np.ndarray:
+    return np.broadcast_to(np.array(value, dtype=dtype), (n_points_tile, 1))
 
-                    n_points_tile = len(loc)
-                    chunks = (n_points_tile, 1)
 
-                    if n_points_tile == 0:
-                        continue
+def _optional_columns(df: pd.DataFrame | dd.DataFrame) -> list[str]:
+    """Per-transcript columns of `df` that are written instead of the default values"""
+    return [name for name in [PointsConstants.Z, PointsConstants.QUALITY_SCORE] if name in df]
 
-                    GRIDS_ATTRS["grid_array_shapes"][-1].append({})
-                    GRIDS_ATTRS["grid_keys"][-1].append(str_index)
-                    GRIDS_ATTRS["grid_number_objects"][-1].append(n_points_tile)
 
-                    tile_group = level_group.create_group(str_index)
-                    tile_group.array(
-                        "valid",
-                        valid[loc],
-                        dtype="uint8",
-                        chunks=chunks,
-                    )
-                    tile_group.array(
-                        "status",
-                        status[loc],
-                        dtype="uint8",
-                        chunks=chunks,
-                    )
-                    tile_group.array(
-                        "location",
-                        location[loc],
-                        dtype="float32",
-                        chunks=chunks,
-                    )
-                    tile_group.array(
-                        "gene_identity",
-                        gene_identity[loc],
-                        dtype="uint16",
-                        chunks=chunks,
-                    )
-                    tile_group.array(
-                        "quality_score",
-                        quality_score[loc],
-                        dtype="float32",
-                        chunks=chunks,
-                    )
-                    tile_group.array(
-                        "codeword_identity",
-                        codeword_identity[loc],
-                        dtype="uint16",
-                        chunks=chunks,
-                    )
-                    tile_group.array(
-                        "uuid",
-                        uuid[loc],
-                        dtype="uint32",
-                        chunks=chunks,
-                    )
-                    tile_group.array(
-                        "id",
-                        transcript_id[loc],
-                        dtype="uint32",
-                        chunks=chunks,
+def _ids_bounds(df: pd.DataFrame | dd.DataFrame) -> tuple:
+    if PointsConstants.TRANSCRIPT_ID not in df:
+        return None, None
+
+    ids = df[PointsConstants.TRANSCRIPT_ID]
+    if not pd.api.types.is_integer_dtype(ids.dtype):
+        return None, None
+
+    return ids.min(), ids.max()
+
+
+def _has_transcript_ids(df: pd.DataFrame | dd.DataFrame, id_min, id_max) -> bool:
+    if PointsConstants.TRANSCRIPT_ID not in df:
+        return False
+
+    if id_min is None or id_min < 0 or id_max > np.iinfo(np.uint32).max:
+        log.info(
+            f"Column '{PointsConstants.TRANSCRIPT_ID}' doesn't contain uint32-compatible integers. Using the transcripts indices instead"
+        )
+        return False
+
+    return True
+
+
+def _bucket_dtype(optional_columns: list[str]) -> np.dtype:
+    fields = [("x", "float64"), ("y", "float64"), ("gene_identity", "uint16"), ("index", "uint64")]
+    fields += [("id", "uint32"), ("rank", "uint64")]
+    return np.dtype(fields + [(name, "float32") for name in optional_columns])
+
+
+def _scan_partitions(df: dd.DataFrame, gene: str, pixel_size: float):
+    """Go once through the partitions to get the gene names, the partitions lengths and the bounds"""
+    x, y = df["x"] * pixel_size, df["y"] * pixel_size
+
+    genes = df[gene]
+    known_categories = isinstance(genes.dtype, pd.CategoricalDtype) and genes.cat.known
+
+    lengths, xmin, ymin, xmax, ymax, genes, ids_bounds = dask.compute(
+        df.map_partitions(len), x.min(), y.min(), x.max(), y.max(), genes.unique(), _ids_bounds(df)
+    )
+
+    if known_categories:
+        gene_names = list(df[gene].cat.categories)
+    else:
+        gene_names = list(pd.Series(genes).astype("category").cat.categories)
+
+    has_ids = _has_transcript_ids(df, *ids_bounds)
+
+    return gene_names, list(lengths), min(xmin, ymin), (xmax, ymax), has_ids
+
+
+def _spill_partitions(
+    df: dd.DataFrame,
+    gene: str,
+    gene_names: list[str],
+    lengths: list[int],
+    pixel_size: float,
+    grid_size: float,
+    buckets_dir: Path,
+    bucket_dtype: np.dtype,
+    has_ids: bool,
+    seed: int | None,
+) -> dict[tuple[int, int], Path]:
+    """Append the transcripts of each partition into per-tile (of level 0) bucket files"""
+    buckets = {}
+    offsets = np.cumsum([0] + lengths)
+    shuffle_keys = _shuffle_keys(seed)
+
+    for i in tqdm(range(df.npartitions), desc="Spilling partitions"):
+        partition = df.get_partition(i).compute()
+
+        records = np.empty(len(partition), dtype=bucket_dtype)
+        location = partition[["x", "y"]] * pixel_size
+        records["x"], records["y"] = location["x"].values, location["y"].values
+        records["gene_identity"] = pd.Categorical(partition[gene], categories=gene_names).codes
+        records["index"] = np.arange(offsets[i], offsets[i + 1])
+        records["id"] = (
+            partition[PointsConstants.TRANSCRIPT_ID].values if has_ids else records["index"]
+        )
+        records["rank"] = _shuffle_ranks(records["index"], int(offsets[-1]), shuffle_keys)
+
+        for name in _optional_columns(partition):
+            records[name] = partition[name].values
+
+        location = np.stack([records["x"], records["y"]], axis=1)
+        tiles_indices = np.floor(location / grid_size).clip(0).astype(np.int64)
+        keys, inverse = np.unique(tiles_indices, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind="stable")
+        ends = np.cumsum(np.bincount(inverse, minlength=len(keys)))
+
+        for (tx, ty), start, end in zip(keys.tolist(), np.concatenate([[0], ends[:-1]]), ends):
+            bucket = buckets.setdefault((tx, ty), buckets_dir / f"{tx}_{ty}.bin")
+            with open(bucket, "ab") as f:
+                records[order[start:end]].tofile(f)
+
+    return buckets
+
+
+def _sort_buckets(
+    buckets: dict[tuple[int, int], Path], bucket_dtype: np.dtype, levels_sizes: list[int]
+) -> dict[Path, np.ndarray]:
+    """Sort each bucket by rank (in place), so that each level only reads a prefix of the buckets
+
+    Returns:
+        For each bucket, the number of its transcripts kept at each level
+    """
+    levels_counts = {}
+
+    for bucket in tqdm(buckets.values(), desc="Sorting buckets"):
+        records = np.fromfile(bucket, dtype=bucket_dtype)
+        records.sort(order="rank")
+        records.tofile(bucket)
+        levels_counts[bucket] = np.searchsorted(records["rank"], levels_sizes)
+
+    return levels_counts
+
+
+def _read_bucket(bucket: Path, bucket_dtype: np.dtype, count: int) -> np.ndarray:
+    """Read the first `count` transcripts of a (sorted) bucket"""
+    return np.fromfile(bucket, dtype=bucket_dtype, count=count)
+
+
+def _write_transcripts_streaming(
+    path: Path,
+    df: dd.DataFrame,
+    gene: str,
+    max_levels: int,
+    pixel_size: float,
+    seed: int | None,
+    n_workers: int,
+    points_per_tile: int | None,
+    compressor: CompressionPolicy,
+    staging_memory_gb: float,
+):
+    grid_size = _grid_size(pixel_size)
+
+    gene_names, lengths, min_location, (xmax, ymax), has_ids = _scan_partitions(
+        df, gene, pixel_size
+    )
+    num_transcripts = sum(lengths)
+
+    if min_location < 0:
+        log.warn("Some transcripts are located outside of the image (pixels < 0)")
+    log.info(f"Writing {num_transcripts} transcripts (streaming over {df.npartitions} partitions)")
+
+    optional_columns = _optional_columns(df)
+    bucket_dtype = _bucket_dtype(optional_columns)
+
+    GRIDS_ATTRS = _grids_attrs(grid_size)
+
+    with tempfile.TemporaryDirectory(prefix=".transcripts_", dir=path.parent) as buckets_dir:
+        buckets = _spill_partitions(
+            df,
+            gene,
+            gene_names,
+            lengths,
+            pixel_size,
+            grid_size,
+            Path(buckets_dir),
+            bucket_dtype,
+            has_ids,
+            seed,
+        )
+
+        # the level `k` keeps the N / 4**k transcripts of lowest rank, as in the in-memory mode
+        levels_sizes = [num_transcripts // 4**level for level in range(max_levels)]
+        levels_counts = _sort_buckets(buckets, bucket_dtype, levels_sizes)
+
+        with explorer_store(path, staging_memory_gb) as store, _TilesWriter(
+            n_workers, compressor
+        ) as tiles_writer:
+            g = zarr.group(store=store)
+            g.attrs.put(_transcripts_attrs(gene_names, num_transcripts))
+
+            grids = g.create_group("grids")
+
+            for level in range(max_levels):
+                level_group = grids.create_group(level)
+
+                tile_size = grid_size * 2**level
+                n_tiles_x = max(1, ceil(xmax / tile_size))
+                n_tiles_y = max(1, ceil(ymax / tile_size))
+
+                GRIDS_ATTRS["grid_array_shapes"].append([])
+                GRIDS_ATTRS["grid_number_objects"].append([])
+                GRIDS_ATTRS["grid_keys"].append([])
+
+                # a tile of level `k` is the union of the 2**k x 2**k buckets it contains
+                tiles_buckets: dict[tuple[int, int], list[Path]] = {}
+                for (tx, ty), bucket in buckets.items():
+                    tiles_buckets.setdefault((tx >> level, ty >> level), []).append(bucket)
+
+                n_capped = 0
+                for tx, ty in sorted(tiles_buckets):
+                    if tx >= n_tiles_x or ty >= n_tiles_y:
+                        continue
+
+                    records = np.concatenate(
+                        [
+                            _read_bucket(bucket, bucket_dtype, levels_counts[bucket][level])
+                            for bucket in tiles_buckets[tx, ty]
+                        ]
                     )
 
-            if n_tiles_x * n_tiles_y == 1 and level > 0:
-                GRIDS_ATTRS["number_levels"] = level + 1
-                break
+                    if not len(records):
+                        continue
 
-            sub_indices = subsample_indices(len(location))
+                    records.sort(order="rank")  # random order, as expected by _cap_tile
 
-            location = location[sub_indices]
-            valid = valid[sub_indices]
-            status = status[sub_indices]
-            gene_identity = gene_identity[sub_indices]
-            quality_score = quality_score[sub_indices]
-            codeword_identity = codeword_identity[sub_indices]
-            uuid = uuid[sub_indices]
-            transcript_id = transcript_id[sub_indices]
+                    if level > 0 and points_per_tile is not None:
+                        n_capped += len(records) > points_per_tile
+                        loc = _cap_tile(
+                            np.arange(len(records)),
+                            np.stack([records["x"], records["y"]], axis=1),
+                            tile_size,
+                            points_per_tile,
+                        )
+                        records = records[loc]
 
-        grids.attrs.put(GRIDS_ATTRS)
+                    columns = {
+                        "location": np.stack([records["x"], records["y"]], axis=1),
+                        "gene_identity": records["gene_identity"],
+                        "id": records["id"],
+                    }
+                    for name in optional_columns:
+                        columns[name] = records[name]
+
+                    tile_arrays = _tile_arrays(columns)
+                    tiles_writer.write(level_group, f"{tx},{ty}", tile_arrays, GRIDS_ATTRS)
+
+                _log_level(level, GRIDS_ATTRS["grid_number_objects"][-1], n_capped)
+
+                if n_tiles_x * n_tiles_y == 1 and level > 0:
+                    GRIDS_ATTRS["number_levels"] = level + 1
+                    break
+
+            grids.attrs.put(GRIDS_ATTRS)
@@ -1,18 +1,35 @@
+from __future__ import annotations
+
+import heapq
 import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from math import ceil
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
 
 import numpy as np
+import shapely
 import zarr
 from shapely.geometry import Polygon
 
-from .._constants import ExplorerConstants, FileNames, cell_summary_attrs, group_attrs
+from .._compression import CompressionPolicy, get_compression_policy
+from .._constants import (
+    ExplorerConstants,
+    FileNames,
+    ShapesConstants,
+    cell_summary_attrs,
+    group_attrs,
+)
+from .._store import DEFAULT_STAGING_MEMORY_GB, explorer_store
 from ..utils import explorer_file_path
 
 log = logging.getLogger(__name__)
 
 TOLERANCE_STEP = 0.5
+PADDING_BATCH_SIZE = 100_000  # number of polygons padded together (bounds the memory usage)
+SIMPLIFICATIONS = ["tolerance", "visvalingam"]
 
 
 def pad_polygon(
@@ -44,12 +61,197 @@ def pad_polygon(
     return pad_polygon(polygon, max_vertices, tolerance + TOLERANCE_STEP)
 
 
+def pad_polygons(
+    polygons: np.ndarray,
+    max_vertices: int,
+    tolerance: float = TOLERANCE_STEP,
+    simplification: str = "tolerance",
+    n_workers: int = 1,
+) -> np.ndarray:
+    """Vectorized version of `pad_polygon` for an array of polygons
+
+    Args:
+        polygons: An array of `shapely` polygons
+        max_vertices: The desired number of vertices
+        tolerance: The step of tolerance used for simplification (see `pad_polygon`). Only used if `simplification="tolerance"`.
+        simplification: Either `"tolerance"` (same vertices as `pad_polygon`: increasing Douglas-Peucker tolerance, often giving less than `max_vertices` vertices), or `"visvalingam"` (Visvalingam-Whyatt: removes the least significant vertices one by one, until exactly `max_vertices` remain).
+        n_workers: Number of processes used to simplify and pad the polygons. The output is the same as with `n_workers=1`.
+
+    Returns:
+        A 2D array of shape `(n_polygons, 2 * max_vertices)` representing the polygons vertices
+    """
+    assert (
+        simplification in SIMPLIFICATIONS
+    ), f"Polygon simplification must be one of {', '.join(SIMPLIFICATIONS)}. Found '{simplification}'"
+
+    shape = (len(polygons), max_vertices, 2)
+    batch_size = min(PADDING_BATCH_SIZE, ceil(len(polygons) / n_workers))
+    batches = [slice(start, start + batch_size) for start in range(0, len(polygons), batch_size)]
+
+    if n_workers == 1 or len(batches) == 1:
+        coordinates = np.empty(shape)
+        for batch in batches:
+            coordinates[batch] = _pad_polygons_batch(
+                polygons[batch], max_vertices, tolerance, simplification
+            )
+        return coordinates.reshape(len(polygons), -1)
+
+    # the workers write their batch directly into a shared output buffer (nothing pickled back)
+    shared_memory = SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+    try:
+        with ProcessPoolExecutor(n_workers) as executor:
+            futures = [
+                executor.submit(
+                    _pad_polygons_shared,
+                    shared_memory.name,
+                    shape,
+                    batch,
+                    polygons[batch],
+                    max_vertices,
+                    tolerance,
+                    simplification,
+                )
+                for batch in batches
+            ]
+            for future in futures:
+                future.result()
+
+        coordinates = np.ndarray(shape, dtype=np.float64, buffer=shared_memory.buf).copy()
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+    return coordinates.reshape(len(polygons), -1)
+
+
+def _pad_polygons_shared(
+    name: str,
+    shape: tuple[int, int, int],
+    batch: slice,
+    polygons: np.ndarray,
+    max_vertices: int,
+    tolerance: float,
+    simplification: str,
+) -> None:
+    shared_memory = SharedMemory(name=name)
+    try:
+        coordinates = np.ndarray(shape, dtype=np.float64, buffer=shared_memory.buf)
+        coordinates[batch] = _pad_polygons_batch(polygons, max_vertices, tolerance, simplification)
+        del coordinates  # release the buffer before closing
+    finally:
+        shared_memory.close()
+
+
+def _pad_polygons_batch(
+    polygons: np.ndarray, max_vertices: int, tolerance: float, simplification: str
+) -> np.ndarray:
+    if simplification == "tolerance":
+        polygons = _simplify_tolerance(polygons, max_vertices, tolerance)
+
+    rings = shapely.get_exterior_ring(polygons)
+    coords = shapely.get_coordinates(rings)
+    n_vertices = shapely.get_num_coordinates(rings)
+    assert (n_vertices >= 3).all()
+
+    if simplification == "visvalingam":
+        coords, n_vertices = _simplify_visvalingam(coords, n_vertices, max_vertices)
+
+    # padding by repeating the last vertex
+    starts = np.cumsum(n_vertices) - n_vertices
+    vertex_index = np.minimum(np.arange(max_vertices), n_vertices[:, None] - 1)
+
+    return coords[starts[:, None] + vertex_index]
+
+
+def _simplify_tolerance(polygons: np.ndarray, max_vertices: int, tolerance: float) -> np.ndarray:
+    polygons = polygons.copy()
+    n_vertices = shapely.get_num_coordinates(shapely.get_exterior_ring(polygons))
+
+    # all the polygons that still have too many vertices are simplified together
+    indices = np.flatnonzero(n_vertices > max_vertices)
+    while len(indices):
+        polygons[indices] = shapely.simplify(polygons[indices], tolerance)
+        n_vertices[indices] = shapely.get_num_coordinates(
+            shapely.get_exterior_ring(polygons[indices])
+        )
+        indices = indices[n_vertices[indices] > max_vertices]
+        tolerance += TOLERANCE_STEP
+
+    return polygons
+
+
+def _simplify_visvalingam(
+    coords: np.ndarray, n_vertices: np.ndarray, max_vertices: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Reduce the rings (flat `coords`, with `n_vertices` per ring) above `max_vertices`"""
+    ends = np.cumsum(n_vertices)
+    rings = np.split(coords, ends[:-1])
+
+    for i in np.flatnonzero(n_vertices > max_vertices):
+        rings[i] = visvalingam_ring(rings[i], max_vertices)
+
+    n_vertices = np.minimum(n_vertices, max_vertices)
+    return np.concatenate(rings), n_vertices
+
+
+def visvalingam_ring(ring: np.ndarray, n_vertices: int) -> np.ndarray:
+    """Visvalingam-Whyatt simplification of a closed ring, in `O(v log v)`
+
+    The vertex forming the smallest triangle with its two neighbours is removed, and the areas of its neighbours are updated, until the ring has the desired number of vertices.
+
+    Args:
+        ring: A 2D array of shape `(v, 2)`, whose last vertex is equal to the first one
+        n_vertices: The desired number of vertices (including the closing vertex), at least 4
+
+    Returns:
+        A 2D array of shape `(n_vertices, 2)`, whose last vertex is equal to the first one
+    """
+    assert n_vertices >= 4, "A ring needs at least 3 distinct vertices"
+
+    xs, ys = ring[:-1, 0].tolist(), ring[:-1, 1].tolist()
+    n = len(xs)
+    previous = [(i - 1) % n for i in range(n)]
+    following = [(i + 1) % n for i in range(n)]
+
+    def area(i: int) -> float:
+        a, b = previous[i], following[i]
+        return abs((xs[a] - xs[i]) * (ys[b] - ys[i]) - (xs[b] - xs[i]) * (ys[a] - ys[i])) / 2
+
+    areas = [area(i) for i in range(n)]
+    heap = [(a, i) for i, a in enumerate(areas)]
+    heapq.heapify(heap)
+
+    removed = [False] * n
+    for _ in range(n - n_vertices + 1):
+        while True:
+            a, i = heapq.heappop(heap)
+            if not removed[i] and a == areas[i]:  # skip the outdated heap entries
+                break
+
+        removed[i] = True
+        following[previous[i]], previous[following[i]] = following[i], previous[i]
+
+        for j in (previous[i], following[i]):
+            # a vertex can't become less significant than a vertex removed before it
+            areas[j] = max(area(j), a)
+            heapq.heappush(heap, (areas[j], j))
+
+    kept = ring[:-1][~np.array(removed)]
+    return np.concatenate([kept, kept[:1]])
+
+
 def write_polygons(
     path: Path,
     polygons: Iterable[Polygon],
     max_vertices: int,
     is_dir: bool = True,
     pixel_size: float = 0.2125,
+    compression: str | dict | CompressionPolicy = "default",
+    simplification: str = "tolerance",
+    n_workers: int = 1,
+    streaming: bool = False,
+    nuclei: Iterable[Polygon | None] | None = None,
+    staging_memory_gb: float = DEFAULT_STAGING_MEMORY_GB,
 ) -> None:
     """Write a `cells.zarr.zip` file containing the cell polygonal boundaries
 
@@ -59,17 +261,54 @@ def write_polygons(
         max_vertices: The number of vertices per polygon (they will be transformed to have the right number of vertices)
         is_dir: If `False`, then `path` is a path to a single file, not to the Xenium Explorer directory.
         pixel_size: Number of microns in a pixel. Invalid value can lead to inconsistent scales in the Explorer.
+        compression: Compressor of each array: one of `"default"`, `"none"`, `"balanced"`, `"compact"`, or a dictionary of compressors per array name (see `CompressionPolicy`).
+        simplification: How polygons with more than `max_vertices` vertices are simplified. Either `"tolerance"` (increasing Douglas-Peucker tolerance), or `"visvalingam"` (Visvalingam-Whyatt, giving exactly `max_vertices` vertices).
+        n_workers: Number of processes used to simplify and pad the polygons.
+        streaming: If `True`, the polygons are processed by batches, and each batch is directly written into the arrays (chunked by batch), so that the memory usage doesn't grow with the number of cells. The values are the same as with `streaming=False`, only the chunks of the arrays differ.
+        nuclei: Optional list of nucleus polygons, one per cell (in the same order as `polygons`), e.g. from `match_nuclei`. A cell whose nucleus is `None` (or all cells if `nuclei` is `None`) uses its cell polygon as nucleus boundary.
+        staging_memory_gb: Size (in gigabytes) of the encoded arrays kept in memory before being spilled to a temporary file, until the `.zarr.zip` file is packed (see `explorer_store`).
     """
     path = explorer_file_path(path, FileNames.SHAPES, is_dir)
+    compressor = get_compression_policy(compression)
 
-    assert all(
-        isinstance(p, Polygon) for p in polygons
-    ), f"All geometries must be a shapely Polygon"
+    polygons = np.asarray(polygons, dtype=object)
+
+    assert (
+        shapely.get_type_id(polygons) == ShapesConstants.POLYGON_TYPE_ID
+    ).all(), f"All geometries must be a shapely Polygon"
+
+    if nuclei is not None:
+        nuclei = _fill_nuclei(polygons, np.asarray(nuclei, dtype=object))
 
     log.info(f"Writing {len(polygons)} cell polygons")
-    coordinates = np.stack([pad_polygon(p, max_vertices) for p in polygons])
+
+    if streaming:
+        _write_polygons_streaming(
+            path,
+            polygons,
+            nuclei,
+            max_vertices,
+            pixel_size,
+            compressor,
+            simplification,
+            n_workers,
+            staging_memory_gb,
+        )
+        return
+
+    coordinates = pad_polygons(
+        polygons, max_vertices, simplification=simplification, n_workers=n_workers
+    )
     coordinates *= pixel_size
 
+    if nuclei is None:
+        nucleus_coordinates = coordinates
+    else:
+        nucleus_coordinates = pad_polygons(
+            nuclei, max_vertices, simplification=simplification, n_workers=n_workers
+        )
+        nucleus_coordinates *= pixel_size
+
     num_cells = len(coordinates)
     cells_fourth = ceil(num_cells / 4)
     cells_half = ceil(num_cells / 2)
@@ -77,11 +316,11 @@ def write_polygons(
     GROUP_ATTRS = group_attrs()
     GROUP_ATTRS["number_cells"] = num_cells
 
-    polygon_vertices = np.stack([coordinates, coordinates])
+    polygon_vertices = np.stack([nucleus_coordinates, coordinates])
     num_points = polygon_vertices.shape[2]
     n_vertices = num_points // 2
 
-    with zarr.ZipStore(path, mode="w") as store:
+    with explorer_store(path, staging_memory_gb) as store:
         g = zarr.group(store=store)
         g.attrs.put(GROUP_ATTRS)
 
@@ -90,32 +329,221 @@ def write_polygons(
             polygon_vertices,
             dtype="float32",
             chunks=(1, cells_fourth, ceil(num_points / 4)),
+            compressor=compressor("polygon_vertices", polygon_vertices, "float32"),
         )
 
         cell_id = np.ones((num_cells, 2))
         cell_id[:, 0] = np.arange(num_cells)
-        g.array("cell_id", cell_id, dtype="uint32", chunks=(cells_half, 1))
+        g.array(
+            "cell_id",
+            cell_id,
+            dtype="uint32",
+            chunks=(cells_half, 1),
+            compressor=compressor("cell_id", cell_id, "uint32"),
+        )
 
-        cell_summary = np.zeros((num_cells, 7))
-        cell_summary[:, 2] = [p.area for p in polygons]
+        cell_summary = _cell_summary(polygons, nuclei, pixel_size)
         g.array(
             "cell_summary",
             cell_summary,
             dtype="float64",
             chunks=(num_cells, 1),
+            compressor=compressor("cell_summary", cell_summary, "float64"),
         )
         g["cell_summary"].attrs.put(cell_summary_attrs())
 
+        polygon_num_vertices = np.full((2, num_cells), n_vertices)
         g.array(
             "polygon_num_vertices",
-            np.full((2, num_cells), n_vertices),
+            polygon_num_vertices,
             dtype="int32",
             chunks=(1, cells_half),
+            compressor=compressor("polygon_num_vertices", polygon_num_vertices, "int32"),
         )
 
+        seg_mask_value = np.arange(num_cells)
         g.array(
             "seg_mask_value",
-            np.arange(num_cells),
+            seg_mask_value,
             dtype="uint32",
             chunks=(cells_half,),
+            compressor=compressor("seg_mask_value", seg_mask_value, "uint32"),
         )
+
+
+def _write_polygons_streaming(
+    path: Path,
+    polygons: np.ndarray,
+    nuclei: np.ndarray | None,
+    max_vertices: int,
+    pixel_size: float,
+    compressor: CompressionPolicy,
+    simplification: str,
+    n_workers: int,
+    staging_memory_gb: float,
+) -> None:
+    num_cells = len(polygons)
+    num_points = 2 * max_vertices
+    chunk_size = max(1, min(PADDING_BATCH_SIZE, num_cells))  # one chunk per batch
+
+    GROUP_ATTRS = group_attrs()
+    GROUP_ATTRS["number_cells"] = num_cells
+
+    with explorer_store(path, staging_memory_gb) as store:
+        g = zarr.group(store=store)
+        g.attrs.put(GROUP_ATTRS)
+
+        def create(name: str, shape: tuple[int, ...], dtype: str, chunks: tuple[int, ...]):
+            return g.zeros(
+                name,
+                shape=shape,
+                dtype=dtype,
+                chunks=chunks,
+                compressor=compressor(name, np.broadcast_to(0, shape), dtype),
+            )
+
+        polygon_vertices = create(
+            "polygon_vertices",
+            (2, num_cells, num_points),
+            "float32",
+            (1, chunk_size, ceil(num_points / 4)),
+        )
+        cell_id = create("cell_id", (num_cells, 2), "uint32", (chunk_size, 1))
+        cell_summary = create("cell_summary", (num_cells, 7), "float64", (chunk_size, 1))
+        cell_summary.attrs.put(cell_summary_attrs())
+        polygon_num_vertices = create(
+            "polygon_num_vertices", (2, num_cells), "int32", (1, chunk_size)
+        )
+        seg_mask_value = create("seg_mask_value", (num_cells,), "uint32", (chunk_size,))
+
+        polygon_sets = [polygons] if nuclei is None else [polygons, nuclei]
+
+        for batch, sets_coordinates in _padded_batches(
+            polygon_sets, max_vertices, simplification, n_workers
+        ):
+            coordinates, *nucleus_coordinates = [
+                (coords.reshape(len(coords), -1) * pixel_size).astype(np.float32)
+                for coords in sets_coordinates
+            ]
+
+            # without nuclei, the nucleus and cell polygons are written from the same buffer
+            polygon_vertices[0, batch] = (
+                nucleus_coordinates[0] if nucleus_coordinates else coordinates
+            )
+            polygon_vertices[1, batch] = coordinates
+
+            indices = np.arange(batch.start, batch.start + len(coordinates))
+
+            cell_id[batch] = np.stack([indices, np.ones_like(indices)], axis=1)
+
+            cell_summary[batch] = _cell_summary(
+                polygons[batch], None if nuclei is None else nuclei[batch], pixel_size
+            )
+
+            polygon_num_vertices[:, batch] = max_vertices
+            seg_mask_value[batch] = indices
+
+
+def _padded_batches(
+    polygon_sets: list[np.ndarray], max_vertices: int, simplification: str, n_workers: int
+) -> Iterator[tuple[slice, list[np.ndarray]]]:
+    """Yield the padded coordinates of consecutive batches of polygons (for each set of polygons), in order"""
+    num_cells = len(polygon_sets[0])
+    batches = [
+        slice(start, start + PADDING_BATCH_SIZE)
+        for start in range(0, num_cells, PADDING_BATCH_SIZE)
+    ]
+    args = (max_vertices, TOLERANCE_STEP, simplification)
+
+    def concatenate_sets(batch: slice) -> tuple[np.ndarray, np.ndarray]:
+        # the sets of one batch are padded together (one task per batch)
+        batch_sets = [polygon_set[batch] for polygon_set in polygon_sets]
+        sections = np.cumsum([len(batch_set) for batch_set in batch_sets])[:-1]
+        return np.concatenate(batch_sets), sections
+
+    if n_workers == 1:
+        for batch in batches:
+            polygons, sections = concatenate_sets(batch)
+            yield batch, np.split(_pad_polygons_batch(polygons, *args), sections)
+        return
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        pending = deque()
+        for batch in batches:
+            polygons, sections = concatenate_sets(batch)
+            future = executor.submit(_pad_polygons_batch, polygons, *args)
+            pending.append((batch, sections, future))
+
+            if len(pending) > n_workers:  # bounded read-ahead
+                batch, sections, future = pending.popleft()
+                yield batch, np.split(future.result(), sections)
+
+        while pending:
+            batch, sections, future = pending.popleft()
+            yield batch, np.split(future.result(), sections)
+
+
+def _fill_nuclei(polygons: np.ndarray, nuclei: np.ndarray) -> np.ndarray:
+    """Use the cell polygon as nucleus polygon for the cells without nucleus"""
+    assert len(nuclei) == len(
+        polygons
+    ), f"Expected one nucleus per cell, found {len(nuclei)} nuclei for {len(polygons)} cells"
+
+    missing = shapely.is_missing(nuclei)
+    if missing.any():
+        log.info(f"{missing.sum()} cells have no nucleus, their cell boundary is used instead")
+
+    nuclei = np.where(missing, polygons, nuclei)
+
+    assert (
+        shapely.get_type_id(nuclei) == ShapesConstants.POLYGON_TYPE_ID
+    ).all(), f"All nuclei must be a shapely Polygon"
+
+    return nuclei
+
+
+def _cell_summary(polygons: np.ndarray, nuclei: np.ndarray | None, pixel_size: float) -> np.ndarray:
+    """Centroids (in microns) and areas (in square microns) of the cells and of their nuclei, as in `cell_summary_attrs`"""
+    nuclei = polygons if nuclei is None else nuclei
+
+    cell_summary = np.zeros((len(polygons), 7))
+    cell_summary[:, :2] = shapely.get_coordinates(shapely.centroid(polygons)) * pixel_size
+    cell_summary[:, 2] = shapely.area(polygons) * pixel_size**2
+    cell_summary[:, 3:5] = shapely.get_coordinates(shapely.centroid(nuclei)) * pixel_size
+    cell_summary[:, 5] = shapely.area(nuclei) * pixel_size**2
+    return cell_summary
+
+
+def match_nuclei(cells: Iterable[Polygon], nuclei: Iterable[Polygon]) -> np.ndarray:
+    """Find the nucleus of each cell, with a spatial index join
+
+    A nucleus belongs to the cell containing its representative point (see `shapely.point_on_surface`). If a cell contains multiple nuclei, the largest one is kept.
+
+    Args:
+        cells: A list of `shapely` polygons representing the cells
+        nuclei: A list of `shapely` polygons representing the nuclei (in any order)
+
+    Returns:
+        An array of nucleus polygons, one per cell (`None` if the cell has no nucleus)
+    """
+    cells, nuclei = np.asarray(cells, dtype=object), np.asarray(nuclei, dtype=object)
+
+    tree = shapely.STRtree(cells)
+    nucleus_indices, cell_indices = tree.query(shapely.point_on_surface(nuclei), predicate="within")
+
+    matched = np.full(len(cells), None, dtype=object)
+
+    if not len(cell_indices):
+        log.warn(f"Found a nucleus for 0 cells out of {len(cells)}")
+        return matched
+
+    # for each cell, the largest nucleus is the last one after sorting by cell and area
+    order = np.lexsort((shapely.area(nuclei[nucleus_indices]), cell_indices))
+    nucleus_indices, cell_indices = nucleus_indices[order], cell_indices[order]
+    is_last = np.append(cell_indices[1:] != cell_indices[:-1], True)
+
+    matched[cell_indices[is_last]] = nuclei[nucleus_indices[is_last]]
+
+    log.info(f"Found a nucleus for {is_last.sum()} cells out of {len(cells)}")
+
+    return matched
@@ -1,21 +1,41 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
-
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+import dask.array as da
 import numpy as np
 import pandas as pd
 import zarr
 from anndata import AnnData
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, issparse
 
+from .._compression import CompressionPolicy, get_compression_policy
 from .._constants import FileNames, cell_categories_attrs
+from .._store import DEFAULT_STAGING_MEMORY_GB, explorer_store
 from ..utils import explorer_file_path
 
 log = logging.getLogger(__name__)
 
+COUNTS_BLOCK_ELEMENTS = 2**26  # max number of matrix elements (genes x cells) read at once
+COUNTS_CHUNK_SIZE = 2**22  # number of values per chunk of the streamed arrays
+
 
 def write_gene_counts(
-    path: str, adata: AnnData, layer: str | None = None, is_dir: bool = True
+    path: str,
+    adata: AnnData,
+    layer: str | None = None,
+    is_dir: bool = True,
+    compression: str | dict | CompressionPolicy = "default",
+    streaming: bool | None = None,
+    staging_memory_gb: float = DEFAULT_STAGING_MEMORY_GB,
 ) -> None:
     """Write a `cell_feature_matrix.zarr.zip` file containing the cell-by-gene transcript counts (i.e., from `adata.X`).
 
@@ -24,18 +44,66 @@ def write_gene_counts(
         adata: An `AnnData` object. Note that `adata.X` must contain raw counts.
         layer: If not `None`, `adata.layers[layer]` will be used instead of `adata.X`. This must contain raw counts.
         is_dir: If `False`, then `path` is a path to a single file, not to the Xenium Explorer directory.
+        compression: Compressor of each array: one of `"default"`, `"none"`, `"balanced"`, `"compact"`, or a dictionary of compressors per array name (see `CompressionPolicy`).
+        streaming: If `True`, the counts are read by blocks of genes and written in bounded chunks, so that the memory usage stays well below the size of the matrix. By default, it is used only if the counts are not in memory (e.g., backed or dask arrays). The values are the same as with `streaming=False`, only the chunks of the arrays differ.
+        staging_memory_gb: Size (in gigabytes) of the encoded arrays kept in memory before being spilled to a temporary file, until the `.zarr.zip` file is packed (see `explorer_store`).
     """
     path = explorer_file_path(path, FileNames.TABLE, is_dir)
+    compressor = get_compression_policy(compression)
 
     log.info(f"Writing table with {adata.n_vars} columns")
     counts = adata.X if layer is None else adata.layers[layer]
+
+    if streaming is None:
+        streaming = not (isinstance(counts, np.ndarray) or issparse(counts))
+
+    ATTRS = _gene_counts_attrs(adata)
+
+    if streaming:
+        _write_gene_counts_streaming(
+            path, counts, adata.n_obs, adata.n_vars, ATTRS, compressor, staging_memory_gb
+        )
+        return
+
     counts = csr_matrix(counts.T)
 
+    total_counts = counts.sum(1).A1
+    loc = total_counts > 0
+
+    data = np.concatenate([counts.data, total_counts[loc]])
+    indices = np.concatenate([counts.indices, np.where(loc)[0]])
+    indptr = counts.indptr
+    indptr = np.append(indptr, indptr[-1] + loc.sum())
+
+    cell_id = np.ones((adata.n_obs, 2))
+    cell_id[:, 0] = np.arange(adata.n_obs)
+
+    with explorer_store(path, staging_memory_gb) as store:
+        g = zarr.group(store=store)
+        cells_group = g.create_group("cell_features")
+        cells_group.attrs.put(ATTRS)
+
+        for name, array in [
+            ("cell_id", cell_id),
+            ("data", data),
+            ("indices", indices),
+            ("indptr", indptr),
+        ]:
+            cells_group.array(
+                name,
+                array,
+                dtype="uint32",
+                chunks=array.shape,
+                compressor=compressor(name, array, "uint32"),
+            )
+
+
+def _gene_counts_attrs(adata: AnnData) -> dict:
     feature_keys = list(adata.var_names) + ["Total transcripts"]
     feature_ids = feature_keys
     feature_types = ["gene"] * len(adata.var_names) + ["aggregate_gene"]
 
-    ATTRS = {
+    return {
         "major_version": 3,
         "minor_version": 0,
         "number_cells": adata.n_obs,
@@ -45,79 +113,354 @@ def write_gene_counts(
         "feature_types": feature_types,
     }
 
-    total_counts = counts.sum(1).A1
-    loc = total_counts > 0
-
-    data = np.concatenate([counts.data, total_counts[loc]])
-    indices = np.concatenate([counts.indices, np.where(loc)[0]])
-    indptr = counts.indptr
-    indptr = np.append(indptr, indptr[-1] + loc.sum())
 
-    cell_id = np.ones((adata.n_obs, 2))
-    cell_id[:, 0] = np.arange(adata.n_obs)
+def _write_gene_counts_streaming(
+    path: Path,
+    counts,
+    n_obs: int,
+    n_vars: int,
+    ATTRS: dict,
+    compressor: CompressionPolicy,
+    staging_memory_gb: float,
+) -> None:
+    total_counts = np.zeros(n_vars)
+    indptr = [0]
 
-    with zarr.ZipStore(path, mode="w") as store:
+    with explorer_store(path, staging_memory_gb) as store, tempfile.TemporaryDirectory(
+        dir=path.parent
+    ) as tmp_dir:
         g = zarr.group(store=store)
         cells_group = g.create_group("cell_features")
         cells_group.attrs.put(ATTRS)
 
-        cells_group.array("cell_id", cell_id, dtype="uint32", chunks=cell_id.shape)
-        cells_group.array("data", data, dtype="uint32", chunks=data.shape)
-        cells_group.array("indices", indices, dtype="uint32", chunks=indices.shape)
-        cells_group.array("indptr", indptr, dtype="uint32", chunks=indptr.shape)
+        def create(name: str, shape: tuple[int, ...], chunks: tuple[int, ...]) -> zarr.Array:
+            # appended arrays start empty: their compressor is chosen for at least one full chunk
+            nominal_shape = tuple(max(size, chunk) for size, chunk in zip(shape, chunks))
+            return cells_group.zeros(
+                name,
+                shape=shape,
+                dtype="uint32",
+                chunks=chunks,
+                compressor=compressor(name, np.broadcast_to(0, nominal_shape), "uint32"),
+            )
+
+        cell_id = create("cell_id", (n_obs, 2), (max(1, min(n_obs, COUNTS_CHUNK_SIZE)), 2))
+        for start in range(0, n_obs, COUNTS_CHUNK_SIZE):
+            ids = np.arange(start, min(start + COUNTS_CHUNK_SIZE, n_obs), dtype=np.uint32)
+            cell_id[start : start + len(ids)] = np.stack([ids, np.ones_like(ids)], axis=1)
+
+        # the total number of non-zero values is unknown: full chunks are appended progressively
+        data = _ChunkedAppender(create("data", (0,), (COUNTS_CHUNK_SIZE,)))
+        indices = _ChunkedAppender(create("indices", (0,), (COUNTS_CHUNK_SIZE,)))
+
+        for start, block in _genes_blocks(counts, n_obs, n_vars, Path(tmp_dir)):
+            total_counts[start : start + block.shape[0]] = block.sum(1).A1
+            data.append(block.data.astype(np.uint32))
+            indices.append(block.indices.astype(np.uint32))
+            indptr.extend((indptr[-1] + block.indptr[1:]).tolist())
+
+        loc = total_counts > 0
+        data.append(total_counts[loc].astype(np.uint32))
+        indices.append(np.where(loc)[0].astype(np.uint32))
+        indptr.append(indptr[-1] + loc.sum())
+
+        data.flush()
+        indices.flush()
+
+        indptr = np.array(indptr, dtype=np.uint32)
+        create("indptr", indptr.shape, indptr.shape)[:] = indptr
+
+
+def _genes_blocks(
+    counts, n_obs: int, n_vars: int, tmp_dir: Path
+) -> Iterator[tuple[int, csr_matrix]]:
+    """Iterate over blocks of genes of the gene-by-cell matrix (i.e., `counts.T`), as CSR matrices"""
+    block_size = max(1, COUNTS_BLOCK_ELEMENTS // max(1, n_obs))  # number of genes per block
+    genes_bounds = [
+        (start, min(start + block_size, n_vars)) for start in range(0, n_vars, block_size)
+    ]
+
+    if getattr(counts, "format", None) == "csc" or isinstance(counts, np.ndarray):
+        # scipy or backed CSC matrix, or dense matrix in memory: the genes are selected directly
+        for start, end in genes_bounds:
+            yield start, csr_matrix(counts[:, start:end].T)
+        return
+
+    # selecting genes of a CSR matrix, or of a dense matrix chunked by cells, reads all its values
+    data, indices, indptr = _transpose_csr(counts, n_obs, n_vars, tmp_dir)
+
+    for start, end in genes_bounds:
+        a, b = indptr[start], indptr[end]
+        yield start, csr_matrix(
+            (data[a:b], indices[a:b], indptr[start : end + 1] - a), shape=(end - start, n_obs)
+        )
+
+
+def _transpose_csr(
+    counts, n_obs: int, n_vars: int, tmp_dir: Path
+) -> tuple[np.memmap, np.memmap, np.ndarray]:
+    """Transpose a cell-by-gene matrix (CSR, dense or dask) into the `(data, indices, indptr)` of a gene-by-cell CSR matrix, where `data` and `indices` are memory-mapped files.
+
+    Selecting genes of a CSR matrix reads all its values, so the cells are read by blocks, twice: once to count the values of each gene, then to write them at their position in the transposed matrix.
+    """
+    block_size = max(1, COUNTS_BLOCK_ELEMENTS // max(1, n_vars))  # number of cells per block
 
+    def cells_blocks() -> Iterator[tuple[int, csr_matrix]]:
+        for start, end in _cells_bounds(counts, n_obs, block_size):
+            block = counts[start:end]
+            if isinstance(block, da.Array):
+                block = block.compute()
+            yield start, csr_matrix(block)
+
+    genes_nnz = np.zeros(n_vars, dtype=np.int64)
+    for _, block in cells_blocks():
+        genes_nnz += np.bincount(block.indices, minlength=n_vars)
+
+    indptr = np.concatenate([[0], np.cumsum(genes_nnz)])
+    nnz = max(1, indptr[-1])  # empty memory maps are not supported
+    data = np.memmap(tmp_dir / "data.npy", dtype=np.uint32, mode="w+", shape=(nnz,))
+    indices = np.memmap(tmp_dir / "indices.npy", dtype=np.uint32, mode="w+", shape=(nnz,))
+
+    cursor = indptr[:-1].copy()
+    for start, block in cells_blocks():
+        block = block.tocoo()
+
+        # a stable sort keeps the cells of each gene in increasing order
+        order = np.argsort(block.col, kind="stable")
+        genes = block.col[order]
+        block_genes_nnz = np.bincount(genes, minlength=n_vars)
+        ranks = np.arange(len(genes)) - (np.cumsum(block_genes_nnz) - block_genes_nnz)[genes]
+
+        positions = cursor[genes] + ranks
+        data[positions] = block.data[order]
+        indices[positions] = block.row[order] + start
+        cursor += block_genes_nnz
+
+    return data, indices, indptr
 
-def _write_categorical_column(
-    root: zarr.Group, index: int, values: np.ndarray, categories: list[str]
-) -> None:
-    group = root.create_group(index)
-    values_indices = [np.where(values == cat)[0] for cat in categories]
-    values_cum_len = np.cumsum([len(indices) for indices in values_indices])
 
-    indices = np.concatenate(values_indices)
-    indptr = np.concatenate([[0], values_cum_len[:-1]])
+def _cells_bounds(counts, n_obs: int, block_size: int) -> list[tuple[int, int]]:
+    """Bounds of the blocks of cells. For a dask array, they are aligned on its chunks (each chunk is computed once), and a block contains at least one chunk."""
+    if not isinstance(counts, da.Array):
+        return [(start, min(start + block_size, n_obs)) for start in range(0, n_obs, block_size)]
 
-    group.array("indices", indices, dtype="uint32", chunks=(len(indices),))
-    group.array("indptr", indptr, dtype="uint32", chunks=(len(indptr),))
+    bounds = [0]
+    chunk_ends = np.cumsum(counts.chunks[0]).tolist()
+    for previous_end, end in zip([0] + chunk_ends, chunk_ends):
+        if end - bounds[-1] > block_size and previous_end > bounds[-1]:
+            bounds.append(previous_end)
+    bounds.append(n_obs)
 
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
 
-def write_cell_categories(path: str, adata: AnnData, is_dir: bool = True) -> None:
+
+class _ChunkedAppender:
+    """Append values to a 1D zarr array, writing only full chunks (except the last one)"""
+
+    def __init__(self, array: zarr.Array):
+        self.array = array
+        self.chunk_size = array.chunks[0]
+        self.buffer = np.empty(0, dtype=array.dtype)
+
+    def append(self, values: np.ndarray) -> None:
+        self.buffer = np.concatenate([self.buffer, values])
+
+        n_full = len(self.buffer) // self.chunk_size * self.chunk_size
+        if n_full:
+            self.array.append(self.buffer[:n_full])
+            self.buffer = self.buffer[n_full:]
+
+    def flush(self) -> None:
+        if len(self.buffer):
+            self.array.append(self.buffer)
+            self.buffer = self.buffer[:0]
+
+
+def _write_categorical_column(
+    root: zarr.Group,
+    index: int,
+    indices: np.ndarray,
+    indptr: np.ndarray,
+    compressor: CompressionPolicy,
+    fingerprint: str,
+) -> None:
+    group = root.create_group(index)
+    group.attrs.put({"fingerprint": fingerprint})
+
+    for name, array in [("indices", indices), ("indptr", indptr)]:
+        group.array(
+            name,
+            array,
+            dtype="uint32",
+            chunks=(len(array),),
+            compressor=compressor(name, array, "uint32"),
+        )
+
+
+def _group_categories(codes: np.ndarray, n_categories: int) -> tuple[np.ndarray, np.ndarray]:
+    """Cells indices sorted by category (in one stable sort), and the start of each category"""
+    indices = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=n_categories)
+    indptr = np.cumsum(counts) - counts
+    return indices, indptr
+
+
+def _categorical_columns(adata: AnnData) -> dict[str, pd.Series]:
+    """Categorical columns of `adata.obs` (the string columns are converted as in `strings_to_categoricals`), without modifying `adata`"""
+    obs = adata.obs.copy(deep=False)
+    adata.strings_to_categoricals(obs)
+    return {name: obs[name] for name, dtype in obs.dtypes.items() if dtype == "category"}
+
+
+def _codes_and_categories(name: str, column: pd.Series) -> tuple[np.ndarray, list[str]]:
+    codes = np.asarray(column.cat.codes)
+    categories = list(column.cat.categories)
+
+    if (codes < 0).any():
+        NA = "NA"
+        log.warn(f"Column {name} has nan values. They will be displayed as '{NA}'")
+        if NA not in categories:
+            categories.append(NA)
+        codes = np.where(codes < 0, categories.index(NA), codes)
+
+    return codes, categories
+
+
+def write_cell_categories(
+    path: str,
+    adata: AnnData,
+    is_dir: bool = True,
+    compression: str | dict | CompressionPolicy = "default",
+    n_workers: int = 1,
+    staging_memory_gb: float = DEFAULT_STAGING_MEMORY_GB,
+) -> None:
     """Write a `analysis.zarr.zip` file containing the cell categories/clusters (i.e., from `adata.obs`)
 
     Args:
         path: Path to the Xenium Explorer directory where the cell-categories file will be written
-        adata: An `AnnData` object
+        adata: An `AnnData` object (it is not modified)
         is_dir: If `False`, then `path` is a path to a single file, not to the Xenium Explorer directory.
+        compression: Compressor of each array: one of `"default"`, `"none"`, `"balanced"`, `"compact"`, or a dictionary of compressors per array name (see `CompressionPolicy`).
+        n_workers: Number of threads used to group the cells of the different columns.
+        staging_memory_gb: Size (in gigabytes) of the encoded arrays kept in memory before being spilled to a temporary file, until the `.zarr.zip` file is packed (see `explorer_store`).
+
+    Note:
+        If the file already exists, the columns that didn't change since it was written (same values, categories and compression) are copied from it instead of being encoded again.
     """
     path = explorer_file_path(path, FileNames.CELL_CATEGORIES, is_dir)
+    compressor = get_compression_policy(compression)
 
-    adata.strings_to_categoricals()
-    cat_columns = [name for name, cat in adata.obs.dtypes.items() if cat == "category"]
+    columns = _categorical_columns(adata)
 
-    log.info(f"Writing {len(cat_columns)} cell categories: {', '.join(cat_columns)}")
+    log.info(f"Writing {len(columns)} cell categories: {', '.join(columns)}")
 
     ATTRS = cell_categories_attrs()
-    ATTRS["number_groupings"] = len(cat_columns)
+    ATTRS["number_groupings"] = len(columns)
+
+    codes_and_categories = [_codes_and_categories(name, column) for name, column in columns.items()]
+    fingerprints = [
+        _column_fingerprint(codes, categories, compressor)
+        for codes, categories in codes_and_categories
+    ]
+
+    unchanged = _read_unchanged_groupings(path, set(fingerprints))
+    if unchanged:
+        n_unchanged = sum(fingerprint in unchanged for fingerprint in fingerprints)
+        log.info(f"{n_unchanged} cell categories are unchanged, they are copied from {path}")
+
+    groups = _group_columns(
+        [item for item, fp in zip(codes_and_categories, fingerprints) if fp not in unchanged],
+        n_workers,
+    )
 
-    with zarr.ZipStore(path, mode="w") as store:
+    with explorer_store(path, staging_memory_gb) as store:
         g = zarr.group(store=store)
         cell_groups = g.create_group("cell_groups")
 
-        for i, name in enumerate(cat_columns):
-            if adata.obs[name].isna().any():
-                NA = "NA"
-                log.warn(f"Column {name} has nan values. They will be displayed as '{NA}'")
-                adata.obs[name] = adata.obs[name].cat.add_categories(NA).fillna(NA)
-
-            categories = list(adata.obs[name].cat.categories)
+        for i, (name, (_, categories), fingerprint) in enumerate(
+            zip(columns, codes_and_categories, fingerprints)
+        ):
             ATTRS["grouping_names"].append(name)
             ATTRS["group_names"].append(categories)
 
-            _write_categorical_column(cell_groups, i, adata.obs[name], categories)
+            if fingerprint in unchanged:
+                for key, value in unchanged[fingerprint].items():
+                    store[f"cell_groups/{i}/{key}"] = value
+            else:
+                indices, indptr = next(groups)
+                _write_categorical_column(cell_groups, i, indices, indptr, compressor, fingerprint)
 
         cell_groups.attrs.put(ATTRS)
 
 
+def _column_fingerprint(
+    codes: np.ndarray, categories: list[str], compressor: CompressionPolicy
+) -> str:
+    """Hash of everything that defines the arrays of one grouping"""
+    compressors = [
+        compressor(name, np.broadcast_to(0, size), "uint32")
+        for name, size in [("indices", len(codes)), ("indptr", len(categories))]
+    ]
+    compressors = [c.get_config() if hasattr(c, "get_config") else c for c in compressors]
+
+    fingerprint = hashlib.blake2b(digest_size=16)
+    fingerprint.update(
+        json.dumps([str(codes.dtype), categories, compressors], default=str).encode()
+    )
+    fingerprint.update(np.ascontiguousarray(codes).data)
+    return fingerprint.hexdigest()
+
+
+def _read_unchanged_groupings(path: Path, fingerprints: set[str]) -> dict[str, dict[str, bytes]]:
+    """Raw content of the groupings of an existing `analysis.zarr.zip` whose fingerprint is in `fingerprints`
+
+    Returns:
+        A dictionary whose keys are fingerprints, and values are the grouping keys (relative to the grouping) and raw bytes
+    """
+    if not path.exists():
+        return {}
+
+    try:
+        with zipfile.ZipFile(path) as zf:
+            keys = zf.namelist()
+
+            indices = {}  # fingerprint -> grouping index in the existing file
+            for key in keys:
+                parts = key.split("/")
+                if len(parts) == 3 and parts[0] == "cell_groups" and parts[2] == ".zattrs":
+                    fingerprint = json.loads(zf.read(key)).get("fingerprint")
+                    if fingerprint in fingerprints:
+                        indices[fingerprint] = parts[1]
+
+            return {
+                fingerprint: {
+                    key[len(f"cell_groups/{index}/") :]: zf.read(key)
+                    for key in keys
+                    if key.startswith(f"cell_groups/{index}/")
+                }
+                for fingerprint, index in indices.items()
+            }
+    except (zipfile.BadZipFile, OSError, ValueError) as e:
+        log.warn(f"Could not read the existing {path} ({e}), all cell categories are written again")
+        return {}
+
+
+def _group_columns(
+    codes_and_categories: list[tuple[np.ndarray, list[str]]], n_workers: int
+) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Yield `_group_categories` of each column, in order (at most `n_workers` columns in advance)"""
+    with ThreadPoolExecutor(n_workers) as executor:
+        pending = deque()
+        for codes, categories in codes_and_categories:
+            pending.append(executor.submit(_group_categories, codes, len(categories)))
+
+            if len(pending) > n_workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
 def save_column_csv(path: str, adata: AnnData, key: str):
     """Save one column of the AnnData object as a CSV that can be open interactively in the explorer, under the "cell" panel.
 
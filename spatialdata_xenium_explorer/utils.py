@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+from functools import lru_cache
 from pathlib import Path
 
 import dask.array as da
@@ -9,10 +10,10 @@ import dask_image.ndinterp
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+import shapely
 import xarray as xr
 from anndata import AnnData
 from multiscale_spatial_image import MultiscaleSpatialImage
-from shapely.geometry import MultiPolygon, Point, Polygon
 from spatial_image import SpatialImage
 from spatialdata import SpatialData
 from spatialdata.models import SpatialElement
@@ -120,14 +121,15 @@ def get_element(sdata: SpatialData, attr: str, key: str | None = None, return_ke
 
 
 def get_spatial_image(
-    sdata: SpatialData, key: str | None = None, return_key: bool = False
-) -> SpatialImage | tuple[str, SpatialImage]:
+    sdata: SpatialData, key: str | None = None, return_key: bool = False, multiscale: bool = False
+) -> SpatialImage | MultiscaleSpatialImage | tuple[str, SpatialImage | MultiscaleSpatialImage]:
     """Gets a SpatialImage from a SpatialData object (if the image has multiple scale, the `scale0` is returned)
 
     Args:
         sdata: SpatialData object.
         key: Optional image key. If `None`, returns the only image (if only one), or raises an error.
         return_key: Whether to also return the key of the image.
+        multiscale: If `True`, a `MultiscaleSpatialImage` is returned as is, instead of its `scale0`.
 
     Returns:
         If `return_key` is False, only the image is returned, else a tuple `(image_key, image)`
@@ -141,7 +143,7 @@ def get_spatial_image(
     assert key is not None, "At least one image in `sdata.images` is required"
 
     image = sdata.images[key]
-    if isinstance(image, MultiscaleSpatialImage):
+    if isinstance(image, MultiscaleSpatialImage) and not multiscale:
         image = SpatialImage(next(iter(image["scale0"].values())))
 
     if return_key:
@@ -199,7 +201,9 @@ def _check_integer_dtype(dtype: np.dtype):
     ), f"Expecting image to have an intenger dtype, but found {dtype}"
 
 
-def scale_dtype(arr: np.ndarray, dtype: np.dtype) -> np.ndarray:
+def scale_dtype(
+    arr: np.ndarray, dtype: np.dtype, window: tuple[float, float] | None = None
+) -> np.ndarray:
     """Change the dtype of an array but keep the scale compared to the type maximum value.
 
     !!! note "Example"
@@ -208,6 +212,7 @@ def scale_dtype(arr: np.ndarray, dtype: np.dtype) -> np.ndarray:
     Args:
         arr: A `numpy` array
         dtype: Target `numpy` data type
+        window: Optional contrast window `(low, high)`. If provided, `low` becomes `0` and `high` becomes the maximum value of `dtype` (the values outside of the window are clipped).
 
     Returns:
         A scaled `numpy` array with the dtype provided.
@@ -215,35 +220,64 @@ def scale_dtype(arr: np.ndarray, dtype: np.dtype) -> np.ndarray:
     _check_integer_dtype(arr.dtype)
     _check_integer_dtype(dtype)
 
-    if arr.dtype == dtype:
+    if arr.dtype == dtype and window is None:
         return arr
 
-    factor = np.iinfo(dtype).max / np.iinfo(arr.dtype).max
-    return (arr * factor).astype(dtype)
+    if arr.dtype.kind == "u" and arr.dtype.itemsize <= 2:
+        return _scaling_lut(arr.dtype, np.dtype(dtype), window)[arr]
+
+    return _scale_values(arr, arr.dtype, dtype, window)
 
 
-def _standardize_shapes(geo_df: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    if geo_df.geometry.map(lambda geom: isinstance(geom, Polygon)).all():
+@lru_cache(maxsize=32)
+def _scaling_lut(
+    source: np.dtype, target: np.dtype, window: tuple[float, float] | None
+) -> np.ndarray:
+    """Lookup table of the scaled value of each value of a small unsigned dtype (avoids float copies of the arrays)"""
+    values = np.arange(np.iinfo(source).max + 1, dtype=source)
+    return _scale_values(values, source, target, window)
+
+
+def _scale_values(
+    arr: np.ndarray, source: np.dtype, target: np.dtype, window: tuple[float, float] | None
+) -> np.ndarray:
+    target_max = np.iinfo(target).max
+
+    if window is None:
+        factor = target_max / np.iinfo(source).max
+        return (arr * factor).astype(target)
+
+    low, high = window
+    factor = target_max / max(high - low, 1)
+    return np.rint(np.clip((arr - low) * factor, 0, target_max)).astype(target)
+
+
+def _standardize_shapes(
+    geo_df: gpd.GeoDataFrame, max_vertices: int | None = None
+) -> gpd.GeoDataFrame:
+    type_ids = shapely.get_type_id(geo_df.geometry.values)
+
+    if (type_ids == ShapesConstants.POLYGON_TYPE_ID).all():
         return geo_df
 
-    if geo_df.geometry.map(lambda geom: isinstance(geom, Point)).all():
+    if (type_ids == ShapesConstants.POINT_TYPE_ID).all():
         if not ShapesConstants.RADIUS in geo_df:
             log.warn(
                 f"GeoDataFrame contains only Point objects, but no column '{ShapesConstants.RADIUS}' was found. Using default {ShapesConstants.RADIUS}={ShapesConstants.DEFAULT_POINT_RADIUS}"
             )
             geo_df[ShapesConstants.RADIUS] = ShapesConstants.DEFAULT_POINT_RADIUS
 
-        geo_df.geometry = geo_df.apply(lambda row: row.geometry.buffer(row.radius), axis=1)
+        geo_df.geometry = _points_to_polygons(
+            geo_df.geometry.values, geo_df[ShapesConstants.RADIUS].values, max_vertices
+        )
         return geo_df
 
-    if geo_df.geometry.map(lambda geom: isinstance(geom, MultiPolygon)).all():
+    if (type_ids == ShapesConstants.MULTIPOLYGON_TYPE_ID).all():
         log.warn(
             "GeoDataFrame contains only MultiPolygon objects. For each MultiPolygon, only the Polygon with the largest area will be shown"
         )
 
-        geo_df.geometry = geo_df.geometry.map(
-            lambda multi_polygon: max(multi_polygon.geoms, key=lambda geom: geom.area)
-        )
+        geo_df.geometry = _largest_parts(geo_df.geometry.values)
         return geo_df
 
     raise ValueError(
@@ -251,6 +285,41 @@ def _standardize_shapes(geo_df: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     )
 
 
+def _points_to_polygons(
+    points: np.ndarray, radius: np.ndarray, max_vertices: int | None = None
+) -> np.ndarray:
+    """Transform points into circles of the given radius
+
+    If `max_vertices` is provided, the circles are directly regular polygons of `max_vertices` vertices (including the closing vertex), else they are `shapely` buffers.
+    """
+    radius = np.asarray(radius, dtype=np.float64)
+
+    if max_vertices is None:
+        return shapely.buffer(points, radius, quad_segs=16)  # same as Point.buffer
+
+    angles = np.linspace(0, 2 * np.pi, max_vertices - 1, endpoint=False)
+    angles = np.append(angles, 0)  # closing vertex, equal to the first one
+    unit_circle = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+    centers = shapely.get_coordinates(points)
+    coords = centers[:, None, :] + radius.reshape(-1, 1, 1) * unit_circle[None, :, :]
+    return shapely.polygons(coords)
+
+
+def _largest_parts(multi_polygons: np.ndarray) -> np.ndarray:
+    """For each MultiPolygon, get its Polygon with the largest area (the first one if equal areas)"""
+    parts, index = shapely.get_parts(multi_polygons, return_index=True)
+    areas = shapely.area(parts)
+
+    # sorted by geometry, then area, then reversed part position: the largest part is the last one
+    order = np.lexsort((-np.arange(len(parts)), areas, index))
+    is_last = np.append(index[order][1:] != index[order][:-1], True)
+
+    largest_parts = np.empty(len(multi_polygons), dtype=object)
+    largest_parts[index[order][is_last]] = parts[order][is_last]
+    return largest_parts
+
+
 def _spot_transcripts_origin(adata: AnnData) -> tuple[dd.DataFrame, str]:
     gene_column = "gene"
     df = pd.DataFrame(
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import spatialdata
+from spatialdata import SpatialData
+from spatialdata.models import Image2DModel, PointsModel
+
+import spatialdata_xenium_explorer
+from spatialdata_xenium_explorer._constants import FileNames
+
+
+def _sdata() -> SpatialData:
+    image = np.random.default_rng(0).integers(0, 255, (1, 256, 256), dtype=np.uint8)
+    image = Image2DModel.parse(image, dims=("c", "y", "x"), scale_factors=[2, 2])
+    points = PointsModel.parse(pd.DataFrame({"x": [1.0, 2.0], "y": [3.0, 4.0]}))
+    return SpatialData(images={"image": image}, points={"points": points})
+
+
+def test_multiscale_image_read_from_zarr_is_skipped(tmp_path):
+    _sdata().write(tmp_path / "sdata.zarr")
+
+    explorer_path = tmp_path / "explorer"
+    image_path = explorer_path / FileNames.IMAGE
+
+    spatialdata_xenium_explorer.write(
+        explorer_path, spatialdata.read_zarr(tmp_path / "sdata.zarr"), mode="+i"
+    )
+    mtime_ns = image_path.stat().st_mtime_ns
+
+    spatialdata_xenium_explorer.write(
+        explorer_path, spatialdata.read_zarr(tmp_path / "sdata.zarr"), mode="+i"
+    )
+    assert image_path.stat().st_mtime_ns == mtime_ns
+
+
+def test_image_procedure_in_fingerprint(tmp_path):
+    sdata = _sdata()
+    image_path = tmp_path / FileNames.IMAGE
+
+    spatialdata_xenium_explorer.write(tmp_path, sdata, mode="+i")
+
+    for kwargs, rewritten in [
+        ({}, False),
+        ({"ram_threshold_gb": None}, True),
+        ({"ram_threshold_gb": None, "lazy": False}, True),
+    ]:
+        mtime_ns = image_path.stat().st_mtime_ns
+        spatialdata_xenium_explorer.write(tmp_path, sdata, mode="+i", **kwargs)
+        assert (image_path.stat().st_mtime_ns != mtime_ns) == rewritten
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import tifffile as tf
+import xarray as xr
+from multiscale_spatial_image import MultiscaleSpatialImage, to_multiscale
+from spatial_image import SpatialImage
+
+from spatialdata_xenium_explorer._constants import FileNames
+from spatialdata_xenium_explorer.core.images import _PyramidReducer, write_image
+
+
+@pytest.mark.parametrize("shape", [(2, 64, 64), (2, 37, 53), (1, 45, 31)])
+@pytest.mark.parametrize("strip_height", [1, 5, 16])
+def test_pyramid_reducer_same_as_to_multiscale(tmp_path, shape, strip_height):
+    image = np.random.default_rng(0).uniform(0, 255, shape)
+    multiscale = to_multiscale(SpatialImage(image, dims=["c", "y", "x"], name="image"), [2, 2, 2])
+    expected = [next(iter(multiscale[name].values())).values for name in multiscale.children]
+
+    reducer = _PyramidReducer([scale.shape for scale in expected], image.dtype, tmp_path)
+    for c in range(shape[0]):
+        for start in range(0, shape[1], strip_height):
+            reducer.add(c, image[c, start : start + strip_height])
+
+    for scale, expected_scale in zip(reducer.scales[1:], expected[1:]):
+        assert np.allclose(scale, expected_scale)
+
+    reducer.close()
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"lazy": False}, {}, {"ram_threshold_gb": None}, {"streaming": True}]
+)
+def test_write_image_reuses_existing_scales(tmp_path, kwargs):
+    image = np.random.default_rng(0).integers(0, 255, (1, 512, 512), dtype=np.uint8)
+    marked = np.full((1, 256, 256), 77, dtype=np.uint8)  # not the coarsened scale0
+    image = MultiscaleSpatialImage.from_dict(
+        {
+            f"scale{i}": xr.Dataset({"image": SpatialImage(array, dims=["c", "y", "x"])})
+            for i, array in enumerate([image, marked])
+        }
+    )
+
+    write_image(tmp_path, image, n_subscales=2, **kwargs)
+
+    with tf.TiffFile(tmp_path / FileNames.IMAGE) as tif:
+        levels = [level.asarray() for level in tif.series[0].levels]
+
+    assert (levels[1] == 77).all()  # existing scale
+    assert (levels[2] == 77).all()  # computed from the existing scale
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from spatial_image import SpatialImage
+
+from spatialdata_xenium_explorer._planner import GB, IMAGE_STRIPS, MemoryPlan
+
+
+@pytest.mark.parametrize("budget_gb", [0.1, 1, 100])
+@pytest.mark.parametrize("parallel", [False, True])
+def test_image_strips_fit_budget(budget_gb, parallel):
+    image = SpatialImage(np.zeros((1, 10, 10), dtype=np.uint8), dims=["c", "y", "x"])
+    plan = MemoryPlan(budget_gb, parallel=parallel)
+
+    kwargs = plan.image_kwargs(image, lazy=True, ram_threshold_gb=4)
+
+    assert 0 < kwargs["max_strip_gb"] <= 0.5
+    assert IMAGE_STRIPS * kwargs["max_strip_gb"] * GB + plan._staging_nbytes() <= budget_gb * GB
@@ -0,0 +1,67 @@
+import zipfile
+
+import dask.dataframe as dd
+import numpy as np
+import pandas as pd
+import pytest
+
+from spatialdata_xenium_explorer.core.points import (
+    _shuffle_keys,
+    _shuffle_ranks,
+    _shuffled_order,
+    write_transcripts,
+)
+
+
+@pytest.mark.parametrize("num_transcripts", [1, 2, 5, 1000, 4097])
+def test_shuffle_ranks_is_a_permutation(num_transcripts):
+    keys = _shuffle_keys(0)
+
+    ranks = _shuffle_ranks(np.arange(num_transcripts), num_transcripts, keys)
+
+    assert np.array_equal(np.sort(ranks), np.arange(num_transcripts))
+    order = _shuffled_order(num_transcripts, keys, chunk_size=100)
+    assert np.array_equal(ranks[order], np.arange(num_transcripts))
+
+
+def _zip_contents(path):
+    with zipfile.ZipFile(path) as zip_file:
+        return {name: zip_file.read(name) for name in zip_file.namelist()}
+
+
+def test_streaming_same_as_in_memory(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 20_000
+    df = pd.DataFrame(
+        {
+            "x": rng.uniform(0, 3000, n),
+            "y": rng.exponential(500, n),
+            "gene": pd.Categorical(rng.choice(list("abcde"), n)),
+            "qv": rng.uniform(0, 40, n),
+        }
+    )
+    df = dd.from_pandas(df, npartitions=3)
+
+    outputs = []
+    for streaming in [False, True]:
+        path = tmp_path / f"streaming={streaming}"
+        path.mkdir()
+        write_transcripts(path, df, streaming=streaming, points_per_tile=500)
+        outputs.append(_zip_contents(path / "transcripts.zarr.zip"))
+
+    assert outputs[0] == outputs[1]
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_tiles_at_the_cap_are_not_capped(tmp_path, caplog, streaming):
+    n = 64  # all in one tile, 16 transcripts on level 1
+    df = pd.DataFrame({"x": np.linspace(0, 1, n), "y": np.linspace(0, 1, n), "gene": ["a"] * n})
+    df = dd.from_pandas(df, npartitions=2)
+
+    with caplog.at_level("INFO"):
+        write_transcripts(tmp_path, df, streaming=streaming, points_per_tile=16)
+        write_transcripts(tmp_path, df, streaming=streaming, points_per_tile=15)
+
+    levels_logs = [r.message for r in caplog.records if r.message.startswith("   > Level 1")]
+    assert levels_logs[0].endswith("0 capped)")
+    assert levels_logs[1].endswith("1 capped)")
@@ -0,0 +1,94 @@
+import numpy as np
+import shapely
+
+from spatialdata_xenium_explorer.core.shapes import (
+    _cell_summary,
+    match_nuclei,
+    pad_polygon,
+    pad_polygons,
+    visvalingam_ring,
+)
+
+
+def _squares(centers: np.ndarray, radius: float) -> np.ndarray:
+    return shapely.buffer(shapely.points(centers), radius, cap_style="square")
+
+
+def test_match_nuclei():
+    cells = _squares(np.array([[0, 0], [10, 0], [20, 0]]), 4)
+    nuclei = _squares(np.array([[10, 0], [0, 1], [0, -1], [50, 50]]), [1, 1, 2, 1])
+
+    matched = match_nuclei(cells, nuclei)
+
+    assert matched[0].equals(nuclei[2])  # largest of the two nuclei
+    assert matched[1].equals(nuclei[0])
+    assert matched[2] is None
+
+
+def test_match_nuclei_no_match():
+    cells = _squares(np.array([[0, 0], [10, 0]]), 4)
+
+    for nuclei in [_squares(np.array([[50, 50]]), 1), np.array([], dtype=object)]:
+        matched = match_nuclei(cells, nuclei)
+        assert len(matched) == len(cells)
+        assert all(nucleus is None for nucleus in matched)
+
+
+def test_cell_summary_units():
+    cells = _squares(np.array([[10, 20]]), 5)
+    nuclei = _squares(np.array([[10, 20]]), 1)
+    pixel_size = 0.5
+
+    cell_summary = _cell_summary(cells, nuclei, pixel_size)
+
+    assert np.allclose(cell_summary[0, :2], [5, 10])
+    assert np.isclose(cell_summary[0, 2], 100 * pixel_size**2)
+    assert np.allclose(cell_summary[0, 3:5], [5, 10])
+    assert np.isclose(cell_summary[0, 5], 4 * pixel_size**2)
+
+
+def _star_ring(n_vertices: int, seed: int = 0) -> np.ndarray:
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    radius = np.random.default_rng(seed).uniform(5, 10, n_vertices)
+    ring = np.stack([radius * np.cos(angles), radius * np.sin(angles)], axis=1)
+    return np.concatenate([ring, ring[:1]])
+
+
+def test_visvalingam_ring_exact_vertices():
+    ring = _star_ring(50)
+
+    for n_vertices in [4, 13, 50, 51]:
+        simplified = visvalingam_ring(ring, n_vertices)
+
+        assert simplified.shape == (n_vertices, 2)
+        assert (simplified[0] == simplified[-1]).all()  # closed ring
+
+        # the kept vertices are a subsequence of the original vertices
+        indices = [
+            np.flatnonzero((ring[:-1] == vertex).all(axis=1))[0] for vertex in simplified[:-1]
+        ]
+        assert (np.diff(indices) > 0).all()
+
+
+def test_visvalingam_ring_removes_collinear_vertices():
+    square = np.array([[0, 0], [1, 0], [2, 0], [2, 1], [2, 2], [1, 2], [0, 2], [0, 1], [0, 0]])
+
+    simplified = visvalingam_ring(square.astype(float), 5)
+
+    assert np.array_equal(simplified, [[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]])
+
+
+def test_pad_polygons_same_as_pad_polygon():
+    max_vertices = 13
+    polygons = np.array(
+        [
+            shapely.Polygon(_star_ring(n_vertices, seed=n_vertices))
+            for n_vertices in [3, 12, 40, 100]
+        ]
+        + list(_squares(np.array([[0, 0], [10, 10]]), [2, 3]))
+    )
+
+    coordinates = pad_polygons(polygons, max_vertices)
+
+    expected = np.stack([pad_polygon(polygon, max_vertices) for polygon in polygons])
+    assert np.array_equal(coordinates, expected)
@@ -0,0 +1,60 @@
+import dask.array as da
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix, vstack
+
+from spatialdata_xenium_explorer.core import table
+from spatialdata_xenium_explorer.core.table import (
+    _genes_blocks,
+    _group_categories,
+    _transpose_csr,
+)
+
+
+@pytest.mark.parametrize("block_elements", [1, 50, 10**6])
+def test_transpose_csr(tmp_path, monkeypatch, block_elements):
+    monkeypatch.setattr(table, "COUNTS_BLOCK_ELEMENTS", block_elements)
+
+    X = np.random.default_rng(0).poisson(0.5, (30, 7))
+    X[:, 3] = 0  # gene without counts
+    X[5] = 0  # cell without counts
+
+    data, indices, indptr = _transpose_csr(csr_matrix(X), *X.shape, tmp_path)
+    transposed = csr_matrix((data[: indptr[-1]], indices[: indptr[-1]], indptr), X.T.shape)
+
+    expected = csr_matrix(X.T)
+    assert np.array_equal(transposed.indptr, expected.indptr)
+    assert np.array_equal(transposed.indices, expected.indices)
+    assert np.array_equal(transposed.data, expected.data)
+
+
+def test_group_categories():
+    n_categories = 6
+    codes = np.random.default_rng(0).integers(0, n_categories - 1, 100)  # last category unused
+
+    indices, indptr = _group_categories(codes, n_categories)
+
+    ends = np.append(indptr[1:], len(codes))
+    for category in range(n_categories):
+        expected = np.where(codes == category)[0]
+        assert np.array_equal(indices[indptr[category] : ends[category]], expected)
+
+
+def test_genes_blocks_dask_chunks_read_twice(tmp_path, monkeypatch):
+    monkeypatch.setattr(table, "COUNTS_BLOCK_ELEMENTS", 200)
+
+    X = np.random.default_rng(0).poisson(0.5, (60, 9))
+    n_computes = {}
+
+    def count_computes(block, block_info=None):
+        location = block_info[0]["chunk-location"]
+        n_computes[location] = n_computes.get(location, 0) + 1
+        return block
+
+    counts = da.from_array(X, chunks=(7, 9)).map_blocks(count_computes, dtype=X.dtype)
+
+    blocks = list(_genes_blocks(counts, *X.shape, tmp_path))
+
+    assert len(blocks) > 1
+    assert np.array_equal(vstack([block for _, block in blocks]).toarray(), X.T)
+    assert set(n_computes.values()) == {2}  # counting, then writing the values